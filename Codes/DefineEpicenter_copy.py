@@ -213,6 +213,58 @@ class DefineEpicenter:
 
         return (grid_y, grid_x)
 
+    def define_rupture(line, stage_data, rupture_ratio=None):
+        """
+        define_epicenter() と同じ分布から破壊の開始点（震源）をサンプリングし、
+        そこから断層（線分）に沿って両側に広がる破壊域のマスを返す。
+        破壊域の長さは線分の長さに対する割合 rupture_ratio
+        （省略時はステージ設定の rupture_length、なければ 0.3）。
+
+        Args:
+            line: calcrate_line() の (start_grid, end_grid)
+            stage_data: get_stage_data() の戻り値
+
+        Returns:
+            cells (ndarray): 破壊域のマス (grid_y, grid_x) の (マス数, 2) の配列。震源から近い順（先頭が震源）
+            distances (ndarray): 各マスの震源からの断層に沿った距離（マス数）
+        """
+        if rupture_ratio is None:
+            rupture_ratio = stage_data[0].get("rupture_length", 0.3)
+
+        # --- 共分散（なければデフォルト値） ---
+        cov_along = stage_data[0].get("covariance_along_line", 1.0)
+        cov_perp  = stage_data[0].get("covariance_perpendicular", 0.1)
+
+        # --- 線分ベクトルと直交ベクトル ---
+        line_vec = line[1] - line[0]
+        line_length = np.linalg.norm(line_vec)
+        line_dir = line_vec / line_length
+        perp_dir = np.array([-line_dir[1], line_dir[0]])  # 線分に直交する方向
+
+        # --- 震源のサンプリング（define_epicenter() と同じ） ---
+        t_along = np.clip(np.random.normal(loc=0.5, scale=np.sqrt(cov_along)), 0.0, 1.0)
+        t_perp  = np.random.normal(loc=0.0, scale=np.sqrt(cov_perp))
+
+        # --- 震源から両側に rupture_ratio / 2 ずつ、1マス間隔で断層上の点を取る ---
+        t_min = max(0.0, t_along - rupture_ratio / 2)
+        t_max = min(1.0, t_along + rupture_ratio / 2)
+        num = int(np.ceil((t_max - t_min) * line_length)) + 1
+        t = np.concatenate([[t_along], np.linspace(t_min, t_max, num)])
+        points = line[0] + t[:, None] * line_vec + t_perp * perp_dir
+        distances = np.abs(t - t_along) * line_length
+
+        # --- 整数のグリッド番号に変換し、範囲外はクリップ ---
+        cells = np.rint(points).astype(int)
+        cells[:, 0] = np.clip(cells[:, 0], 0, stage_data[2] - 1)
+        cells[:, 1] = np.clip(cells[:, 1], 0, stage_data[1] - 1)
+
+        # --- 震源から近い順に並べ、同じマスは一番近いものだけ残す ---
+        order = np.argsort(distances, kind="stable")
+        cells, distances = cells[order], distances[order]
+        _, first = np.unique(cells, axis=0, return_index=True)
+        first = np.sort(first)
+        return cells[first], distances[first]
+
 
 if __name__ == "__main__":
     stage_data = {
@@ -245,4 +297,6 @@ if __name__ == "__main__":
     print("sample_point_4 " + str(area[3]))
 
     print("震源位置（grid_y, grid_x）:", epicenter)
+    cells, distances = DefineEpicenter.define_rupture(line, get_stage)
+    print("破壊域（grid_y, grid_x）:", cells.tolist())
     # 例: 震源位置（grid_y, grid_x）: (29, 32)
\ No newline at end of file
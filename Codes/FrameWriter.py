@@ -0,0 +1,190 @@
+## フレーム画像・動画の書き出し
+# - 計算ループではフレームの場をコピーしてキューに入れるだけにし、描画・保存はバックグラウンドで行う
+# - pyplot はスレッドセーフではないので、描画は Figure を直接作る（Agg で PNG に書き出す）
+# - 描画は Python の処理が中心で GIL を握るため、複数コアで並列に描画したい場合はプロセスを使う
+# - 動画は PNG を経由せず、場をカラーマップの参照表で RGB にしてから1枚ずつエンコーダに渡す
+import os
+import queue
+import threading
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+from matplotlib import colormaps
+from matplotlib.figure import Figure
+
+
+def render_png(path, field, cmap, vmin, vmax, label, title):
+    """2次元の場をカラーマップで描画して PNG に保存する（pyplot を使わないのでどのスレッドからでも呼べる）"""
+    fig = Figure(figsize=(6, 5))
+    ax = fig.add_subplot()
+    image = ax.imshow(field, cmap=cmap, vmin=vmin, vmax=vmax)
+    fig.colorbar(image, ax=ax, label=label)
+    ax.set_title(title)
+    ax.axis("off")
+    fig.tight_layout()
+    fig.savefig(path)
+
+
+def write_frame(step, field, output_dir, cmap, label, title, symmetric):
+    """
+        step 番目のフレームを output_dir/frame_{step:05d}.png に保存する。
+        色の範囲は symmetric なら [-max, max]、そうでなければ [0, max]。
+        title は "{step}" を含む書式文字列。
+    """
+    vmax = np.max(field)
+    vmin = -vmax if symmetric else 0
+    render_png(f"{output_dir}/frame_{step:05d}.png", field, cmap, vmin, vmax, label, title.format(step=step))
+
+
+def colormap_lut(cmap, n=256):
+    """カラーマップ名から (n, 3) の uint8 の RGB 参照表を作る"""
+    rgba = colormaps[cmap](np.linspace(0.0, 1.0, n))
+    return (rgba[:, :3] * 255).round().astype(np.uint8)
+
+
+def colorize(field, lut, vmin, vmax):
+    """場の値を [vmin, vmax] で参照表の番号に変換し、(nx, ny, 3) の RGB 画像にする"""
+    scale = (len(lut) - 1) / (vmax - vmin) if vmax > vmin else 0.0
+    index = np.clip((field - vmin) * scale, 0, len(lut) - 1).astype(np.intp)
+    return lut[index]
+
+
+class VideoFrameWriter:
+    """
+        場を1フレームずつ直接動画にエンコードする（PNG を経由しない）。
+        render(step, field) の形で呼べるので、AsyncFrameWriter（スレッド）の描画関数としても使える。
+
+        フレームは開いたエンコーダに逐次渡すので、動画の長さによらずメモリ使用量は一定。
+    """
+
+    def __init__(self, output_path, fps=10, cmap="seismic", symmetric=True, vmax=None, scale=None):
+        """
+            Parameters:
+                output_path (str): 出力する動画ファイル（.mp4 / .gif など imageio が扱える形式）
+                cmap (str): カラーマップ名
+                symmetric (bool): 色の範囲を [-vmax, vmax] にするか（False なら [0, vmax]）
+                vmax (float): 色の範囲の上限。None ならフレーム毎の最大値
+                scale (int): 1マスを何ピクセル四方にするか。None なら短辺が 256 ピクセル程度になるようにする
+        """
+        import imageio.v2 as imageio
+
+        self.lut = colormap_lut(cmap)
+        self.symmetric = symmetric
+        self.vmax = vmax
+        self.scale = scale
+        self._writer = imageio.get_writer(output_path, fps=fps)
+
+    def __call__(self, step, field):
+        self.append(field)
+
+    def append(self, field):
+        """フレームを1枚エンコードする"""
+        field = np.asarray(field)
+        vmax = np.max(field) if self.vmax is None else self.vmax
+        vmin = -vmax if self.symmetric else 0
+        image = colorize(field, self.lut, vmin, vmax)
+        scale = self.scale if self.scale is not None else max(1, 256 // min(field.shape))
+        if scale > 1:
+            image = np.repeat(np.repeat(image, scale, axis=0), scale, axis=1)
+        # 多くのコーデックは16ピクセル単位の大きさを要求するので、端の色で埋めて揃える（エンコーダ側での拡大を避ける）
+        height, width = image.shape[:2]
+        image = np.pad(image, ((0, -height % 16), (0, -width % 16), (0, 0)), mode="edge")
+        self._writer.append_data(image)
+
+    def close(self):
+        self._writer.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def make_video_from_frames(frame_dir="frames", output_path="simulation.mp4", fps=10):
+    """frame_dir の PNG を名前順に1枚ずつ読み込んで動画にする（全フレームをメモリに載せない）"""
+    import imageio.v2 as imageio
+
+    files = sorted(os.path.join(frame_dir, f) for f in os.listdir(frame_dir) if f.endswith(".png"))
+    with imageio.get_writer(output_path, fps=fps) as writer:
+        for f in files:
+            writer.append_data(imageio.imread(f))
+
+
+class AsyncFrameWriter:
+    """
+        フレームの描画・書き出しをバックグラウンドで行う。
+
+        submit() は場をコピーして書き出し待ちにするだけなので、計算を止めない
+        （書き出し待ちが max_queue 枚で一杯のときだけ、空くまで待つ）。
+        close() で残ったフレームを全て書き出し終わるまで待つ。
+
+        processes=0 なら1本のスレッドで、processes > 0 ならその数のプロセスで並列に描画する
+        （プロセスを使う場合、render はモジュールの関数（と functools.partial）など pickle できるものにする）。
+    """
+
+    def __init__(self, render, max_queue=16, processes=0):
+        """
+            Parameters:
+                render (callable): render(step, field) でフレームを1枚書き出す関数
+                max_queue (int): 書き出し待ちにできるフレームの最大数（メモリ使用量の上限）
+                processes (int): 描画に使うプロセス数（0 ならスレッド）
+        """
+        self.render = render
+        self.max_queue = max_queue
+        self._error = None
+        if processes > 0:
+            self._executor = ProcessPoolExecutor(max_workers=processes)
+            self._pending = deque()
+            self._thread = None
+        else:
+            self._executor = None
+            self._queue = queue.Queue(maxsize=max_queue)
+            self._thread = threading.Thread(target=self._worker, daemon=True)
+            self._thread.start()
+
+    def submit(self, step, field):
+        """step 番目のフレームとして field のコピーを書き出し待ちにする"""
+        if self._error is not None:
+            raise self._error
+        field = np.array(field, copy=True)
+        if self._executor is None:
+            self._queue.put((step, field))
+            return
+        # 書き出し待ちが一杯なら、一番古いフレームが終わるまで待つ
+        while len(self._pending) >= self.max_queue:
+            self._pending.popleft().result()
+        self._pending.append(self._executor.submit(self.render, step, field))
+
+    def _worker(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                break
+            # 失敗した後もキューは空にし続ける（submit() 側が待ち続けないように）
+            if self._error is None:
+                try:
+                    self.render(*item)
+                except Exception as e:
+                    self._error = e
+
+    def close(self):
+        """残りのフレームを全て書き出すまで待つ。書き出し中にエラーがあればここで送出する"""
+        if self._executor is not None:
+            try:
+                while self._pending:
+                    self._pending.popleft().result()
+            finally:
+                self._executor.shutdown(cancel_futures=True)
+        elif self._thread.is_alive():
+            self._queue.put(None)
+            self._thread.join()
+        if self._error is not None:
+            raise self._error
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
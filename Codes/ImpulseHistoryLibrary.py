@@ -0,0 +1,122 @@
+from collections import OrderedDict
+
+import numpy as np
+
+from EQSimulator import EQSimulatorVariableRho
+
+
+class ImpulseHistoryLibrary:
+    """
+        震源のマス毎の単位インパルス応答の時系列（マグニチュード1の点震源の各ステップの変位）を保持するライブラリ。
+
+        波の更新式は線形なので、断層に沿って少しずつ遅れて破壊が進む震源（複数の点震源の和）の揺れは、
+        各マスの時系列を破壊が届くステップだけずらして足し合わせれば、シミュレーションし直さずに求められる。
+        u_max は重ね合わせられない（最大値の時刻がずれる）ので、ImpulseResponseLibrary とは別に時系列を持つ。
+
+        時系列は (steps, nx, ny) とマス毎に大きいので、全マス分は作らず、使われたマスの分だけ計算して覚えておく。
+        覚えておく量は max_bytes までで、超えたら最後に使ってから一番時間の経ったマスから捨てる
+        （捨てたマスは次に使うときに計算し直す）。既定の float32・256MB なら、200 ステップ・25×25 のマップで
+        約 500 マス分（1マス 0.5MB）。
+    """
+
+    def __init__(self, rho_map, mu, dt, steps, dx=1.0, batch_size=16, dtype=np.float32, max_bytes=256 * 2 ** 20):
+        """
+            Parameters:
+                rho_map (ndarray): 地盤の脆さ（EQSimulatorVariableRho の rho_map と同じもの）
+                mu, dt, steps, dx: シミュレーション条件（実際のシミュレーションと揃える）
+                batch_size (int): 一度にアンサンブル計算する震源の数
+                dtype: 時系列を覚えておく型（計算自体は倍精度で行い、保存時に変換する）
+                max_bytes (int): 覚えておく時系列のメモリの上限
+        """
+        self.rho_map = np.asarray(rho_map)
+        self.grid_shape = self.rho_map.shape
+        self.mu = mu
+        self.dt = dt
+        self.steps = steps
+        self.dx = dx
+        self.batch_size = batch_size
+        self.dtype = np.dtype(dtype)
+        self.max_bytes = max_bytes
+        self.history_bytes = steps * self.rho_map.size * self.dtype.itemsize  # 1マス分の時系列のサイズ
+        if self.history_bytes > max_bytes:
+            raise ValueError(f"max_bytes={max_bytes} では1マス分の時系列（{self.history_bytes} バイト）も覚えられません。")
+        self.c_min = np.sqrt(mu / np.max(self.rho_map))  # 最も遅い波速
+        self._histories = OrderedDict()  # 震源 (x, y) → (steps, nx, ny) の時系列（最後に使った順）
+
+    def _build(self, cells):
+        """cells の各マスを震源とした単位インパルス応答の時系列を計算して {マス: 時系列} で返す"""
+        built = {}
+        for start in range(0, len(cells), self.batch_size):
+            batch = cells[start:start + self.batch_size]
+            sim = EQSimulatorVariableRho(
+                epicenter=batch,
+                magnitude=1.0,
+                grid_shape=self.grid_shape,
+                rho_map=self.rho_map,
+                dx=self.dx,
+                dt=self.dt,
+                mu=self.mu,
+            )
+            histories = np.zeros((len(batch), self.steps) + self.grid_shape)
+            # k ステップ目（1始まり）の場を histories[:, k - 1] に入れる
+            for done, u_curr, _ in sim.iter_steps(self.steps):
+                histories[:, done - 1] = u_curr
+            # マス毎に別の配列にして、捨てたマスのメモリがすぐ解放されるようにする
+            for cell, history in zip(batch, histories):
+                built[tuple(int(v) for v in cell)] = history.astype(self.dtype)
+        return built
+
+    def _evict(self):
+        """覚えている時系列が max_bytes を超えた分を、最後に使ったのが古いマスから捨てる"""
+        while len(self._histories) * self.history_bytes > self.max_bytes:
+            self._histories.popitem(last=False)
+
+    def histories(self, cells):
+        """
+            cells の各マスの時系列を (マス数, steps, nx, ny) で返す（未計算のマスはまとめて計算する）。
+            返す配列は覚えている分とは別のコピーなので、cells が max_bytes に収まらなくても全マス分そろう。
+        """
+        cells = [tuple(int(v) for v in cell) for cell in cells]
+        missing = list(dict.fromkeys(cell for cell in cells if cell not in self._histories))
+        if missing:
+            self._histories.update(self._build(np.array(missing)))
+        result = np.empty((len(cells), self.steps) + self.grid_shape, dtype=self.dtype)
+        for k, cell in enumerate(cells):
+            result[k] = self._histories[cell]
+            self._histories.move_to_end(cell)
+        self._evict()
+        return result
+
+    def rupture_delays(self, distances, rupture_speed=None):
+        """
+            震源からの距離 distances（マス数）に破壊が届くまでのステップ数。
+            rupture_speed を省略した場合は、最も遅い波速の 0.8 倍で破壊が進むとする。
+        """
+        if rupture_speed is None:
+            rupture_speed = 0.8 * self.c_min
+        return np.rint(np.asarray(distances) * self.dx / (rupture_speed * self.dt)).astype(int)
+
+    def lookup_rupture(self, cells, distances, magnitude, rupture_speed=None):
+        """
+            断層のマス cells が、震源からの距離 distances に応じて順に破壊したときの揺れの最大値の配列を返す。
+            マグニチュードは全てのマスに均等に分ける（1マスなら点震源と同じ結果）。
+
+            マス k が delay_k ステップ目に破壊する（点震源の初期条件と同じく、その時点の u_curr に振幅を加える）
+            シミュレーションと同じく、t ステップ目の場は Σ_k a_k·h_k[t - 1 - delay_k]、u_max は t = 1..steps での |場| の最大値になる。
+            破壊が steps 以降に届くマスは含めない。
+
+            Returns:
+                ndarray: EQSimulatorVariableRho.run() の戻り値と同じ (nx, ny) の配列
+        """
+        cells = np.asarray(cells, dtype=int).reshape(-1, 2)
+        delays = self.rupture_delays(distances, rupture_speed)
+        if len(delays) != len(cells):
+            raise ValueError(f"cells と distances の長さが一致しません。cells: {len(cells)}\ndistances: {len(delays)}")
+        inside = delays < self.steps
+        cells, delays = cells[inside], delays[inside]
+        amplitude = magnitude / len(cells)
+
+        field = np.zeros((self.steps,) + self.grid_shape)
+        for history, delay in zip(self.histories(cells), delays):
+            field[delay:] += amplitude * history[:self.steps - delay]
+        return np.abs(field).max(axis=0)
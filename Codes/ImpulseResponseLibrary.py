@@ -0,0 +1,139 @@
+import hashlib
+import json
+from pathlib import Path
+
+import numpy as np
+
+from EQSimulator import EQSimulatorVariableRho
+
+
+class ImpulseResponseLibrary:
+    """
+        ステージ毎の単位インパルス応答（各マスを震源としたマグニチュード1の u_max）をまとめたライブラリ。
+
+        波の更新式は初期振幅に対して線形なので、マグニチュード M の u_max は
+        同じ震源の単位応答の |M| 倍になる。一度だけ全震源分を計算して .npy に保存し、
+        以降はメモリマップで読み込んで (震源, マグニチュード) を配列の掛け算1回で求める。
+    """
+
+    def __init__(self, path, responses, metadata):
+        self.path = Path(path)
+        self.responses = responses  # (nx, ny, nx, ny): [震源x, 震源y] → u_max
+        self.metadata = metadata
+        self.grid_shape = tuple(metadata["grid_shape"])
+
+    @staticmethod
+    def _metadata(rho_map, mu, dt, steps, dx):
+        rho_map = np.ascontiguousarray(rho_map, dtype=np.float64)
+        return {
+            "grid_shape": list(rho_map.shape),
+            "mu": float(mu),
+            "dt": float(dt),
+            "dx": float(dx),
+            "steps": int(steps),
+            "rho_hash": hashlib.sha1(rho_map.tobytes()).hexdigest(),
+        }
+
+    @staticmethod
+    def _metadata_path(path):
+        return Path(path).with_suffix(".json")
+
+    @classmethod
+    def build(cls, path, rho_map, mu, dt, steps, dx=1.0, batch_size=64, dtype=np.float64, max_bytes=2 * 2 ** 30):
+        """
+            全マスの単位インパルス応答を計算して path (.npy) に保存する。
+            保存する配列は (nx·ny)² 要素なので、max_bytes を超える大きさのマップでは作らずに ValueError を出す
+            （既定の 2GB なら倍精度で 128×128 程度まで。25×25 のステージは約 3MB）。
+
+            Parameters:
+                path (str | Path): 保存先の .npy ファイル
+                rho_map (ndarray): 地盤の脆さ（EQSimulatorVariableRho の rho_map と同じもの）
+                mu, dt, steps, dx: シミュレーション条件（実際のシミュレーションと揃える）
+                batch_size (int): 一度にアンサンブル計算する震源の数
+                max_bytes (int): 保存する配列の大きさの上限
+
+            Returns:
+                ImpulseResponseLibrary: 読み込み済みのライブラリ
+        """
+        nx, ny = rho_map.shape
+        size = (nx * ny) ** 2 * np.dtype(dtype).itemsize
+        if size > max_bytes:
+            raise ValueError(
+                f"単位インパルス応答ライブラリが大きすぎます（{nx}×{ny} のマップで {size / 2 ** 30:.1f}GB、上限 {max_bytes / 2 ** 30:.1f}GB）。\n"
+                "ライブラリを使わずにシミュレーションするか、max_bytes を指定してください。"
+            )
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        metadata = cls._metadata(rho_map, mu, dt, steps, dx)
+
+        responses = np.lib.format.open_memmap(path, mode="w+", dtype=dtype, shape=(nx * ny, nx, ny))
+        cells = np.array([(x, y) for x in range(nx) for y in range(ny)])
+        for start in range(0, len(cells), batch_size):
+            batch = cells[start:start + batch_size]
+            sim = EQSimulatorVariableRho(
+                epicenter=batch,
+                magnitude=1.0,
+                grid_shape=(nx, ny),
+                rho_map=rho_map,
+                dx=dx,
+                dt=dt,
+                mu=mu,
+            )
+            responses[start:start + len(batch)] = sim.run(steps=steps)
+        responses.flush()
+        del responses
+
+        with open(cls._metadata_path(path), "w", encoding="utf-8") as f:
+            json.dump(metadata, f, indent=4)
+
+        return cls.load(path)
+
+    @classmethod
+    def load(cls, path):
+        """保存済みのライブラリをメモリマップで読み込む"""
+        path = Path(path)
+        with open(cls._metadata_path(path), "r", encoding="utf-8") as f:
+            metadata = json.load(f)
+        nx, ny = metadata["grid_shape"]
+        responses = np.load(path, mmap_mode="r").reshape(nx, ny, nx, ny)
+        return cls(path, responses, metadata)
+
+    @classmethod
+    def load_or_build(cls, path, rho_map, mu, dt, steps, dx=1.0, **build_kwargs):
+        """保存済みのライブラリが同じ条件で作られていれば読み込み、なければ作り直す"""
+        path = Path(path)
+        metadata_path = cls._metadata_path(path)
+        if path.exists() and metadata_path.exists():
+            with open(metadata_path, "r", encoding="utf-8") as f:
+                saved = json.load(f)
+            if saved == cls._metadata(rho_map, mu, dt, steps, dx):
+                return cls.load(path)
+        return cls.build(path, rho_map, mu, dt, steps, dx=dx, **build_kwargs)
+
+    def lookup(self, epicenter, magnitude):
+        """
+            震源とマグニチュードに対する揺れの最大値の配列を返す
+
+            Returns:
+                ndarray: EQSimulatorVariableRho.run() の戻り値と同じ (nx, ny) の配列
+        """
+        x0, y0 = epicenter
+        return abs(magnitude) * self.responses[x0, y0]
+
+
+if __name__ == "__main__":
+    import time
+
+    rho_map = np.random.uniform(0.5, 0.9, size=(25, 25))
+    library = ImpulseResponseLibrary.load_or_build(
+        "../Data/impulse/debug_eq.npy", rho_map=rho_map, mu=10.0, dt=0.05, steps=200
+    )
+
+    start = time.perf_counter()
+    shaking_map = library.lookup((12, 7), 7.5)
+    print(f"lookup: {time.perf_counter() - start:.6f} s")
+
+    sim = EQSimulatorVariableRho(
+        epicenter=(12, 7), magnitude=7.5, grid_shape=(25, 25), rho_map=rho_map, mu=10.0, dt=0.05
+    )
+    print("max abs error:", np.abs(sim.run(steps=200) - shaking_map).max())
@@ -0,0 +1,144 @@
+## 粗いグリッドでの先行計算（マルチ解像度プレビュー）
+# - 地盤マップを factor×factor マスのブロック平均で粗くし、dx を factor 倍にして計算する
+# - 結果を元の解像度に戻した u_max をプレビューとしてすぐに返し、後から細かい解像度の結果で置き換える
+# - 2段階の解像度の結果の差から誤差を見積もり、全ての建物の倒壊判定が決まっていれば細かい計算を省ける
+import numpy as np
+from scipy.ndimage import maximum_filter
+
+
+def downsample(field, factor):
+    """
+        (nx, ny) の配列を factor×factor マスのブロック平均で縮小する。
+        割り切れない場合は端の値で埋めてから平均する。
+    """
+    field = np.asarray(field)
+    nx, ny = field.shape
+    cx, cy = -(-nx // factor), -(-ny // factor)
+    padded = np.pad(field, ((0, cx * factor - nx), (0, cy * factor - ny)), mode='edge')
+    return padded.reshape(cx, factor, cy, factor).mean(axis=(1, 3))
+
+
+def upsample(field, factor, shape):
+    """縮小した配列の各マスを factor×factor マスに複製し、元の形状 shape に切り出す（先頭のアンサンブル軸はそのまま）"""
+    nx, ny = shape
+    return np.repeat(np.repeat(field, factor, axis=-2), factor, axis=-1)[..., :nx, :ny]
+
+
+def coarse_kwargs(simulator_class, factor, **kwargs):
+    """
+        シミュレーターのコンストラクタ引数を factor 倍粗いグリッド用に変換する。
+
+        - 地盤マップ（MAP_ARG）と active_mask はブロック単位でまとめる
+        - 震源は含まれるブロックに移し、初期振幅はブロック平均と同じく 1/factor² にする
+          （初期変位の総量を保つ。点震源の形はグリッドに依存するので、この違いも誤差に含まれる）
+        - dx は factor 倍にし、dt はそのまま使う（dx が大きくなるので CFL 条件は緩くなる）
+    """
+    kwargs = dict(kwargs)
+    nx, ny = kwargs["grid_shape"]
+    kwargs["grid_shape"] = (-(-nx // factor), -(-ny // factor))
+    kwargs[simulator_class.MAP_ARG] = downsample(kwargs[simulator_class.MAP_ARG], factor)
+    if kwargs.get("active_mask") is not None:
+        kwargs["active_mask"] = downsample(kwargs["active_mask"], factor) > 0
+    kwargs[simulator_class.SOURCE_ARG] = np.asarray(kwargs[simulator_class.SOURCE_ARG], dtype=int) // factor
+    kwargs[simulator_class.AMPLITUDE_ARG] = np.asarray(kwargs[simulator_class.AMPLITUDE_ARG], dtype=float) / factor ** 2
+    kwargs["dx"] = kwargs.get("dx", 1.0) * factor
+    return kwargs
+
+
+def _duration(kwargs, steps, duration):
+    """粗さによらず同じ物理時間を計算するため、steps を物理時間に直す"""
+    if duration is not None:
+        return duration
+    dt = kwargs.get("dt", 0.1)
+    if dt == "auto":
+        raise ValueError("dt=\"auto\" の場合は解像度毎に dt が変わるので、steps ではなく duration を指定してください。")
+    return steps * dt
+
+
+def coarse_run(simulator_class, factor, steps=200, duration=None, thresholds=None, **kwargs):
+    """
+        factor 倍粗いグリッドで計算し、元の解像度に戻した u_max を返す（factor=1 なら通常の計算）
+
+        Parameters:
+            simulator_class: EQSimulatorVariableRho / TsunamiSimulatorVariableRho
+            factor (int): 縮小率
+            steps, duration: 元の解像度でのステップ数、または物理時間
+            thresholds (ndarray): 倒壊閾値。factor=1 の場合だけ run() に渡して早期終了する
+                                  （粗いグリッドではマスが建物と対応しないので使わない）
+            kwargs: 元の解像度でのコンストラクタの引数
+    """
+    duration = _duration(kwargs, steps, duration)
+    # プレビューでは観測点の波形は記録しない
+    kwargs = {key: value for key, value in kwargs.items() if key not in ("stations", "station_stride")}
+    sim = simulator_class(**(coarse_kwargs(simulator_class, factor, **kwargs) if factor > 1 else kwargs))
+    try:
+        u_max = sim.run(duration=duration, thresholds=thresholds if factor == 1 else None)
+    finally:
+        sim.close()
+    return upsample(u_max, factor, kwargs["grid_shape"])
+
+
+def estimate_error(fine, coarse, factor, safety=2.0):
+    """
+        縮小率 factor の結果 fine の誤差を、1段階粗い結果 coarse との差から見積もる。
+
+        u_max の誤差は干渉の山谷の位置ずれでマス毎に大きく振れ、差が偶然小さいマスもあるので、
+        周囲 (2·factor+1)² マスでの差の最大値 × safety を誤差とする
+        （解像度を2倍にしても誤差は半分程度にしか減らないので、差より大きめに取る）
+    """
+    size = 2 * factor + 1
+    return safety * maximum_filter(np.abs(fine - coarse), size=(1,) * (fine.ndim - 2) + (size, size))
+
+
+def decides_all(u_max, error, thresholds):
+    """
+        誤差 error の範囲で u_max が変わっても、全てのマスの倒壊判定（u_max > thresholds）が変わらないかを返す。
+        建物のないマス（thresholds が np.inf）は常に判定済みとみなす。
+    """
+    collapsed = u_max - error > thresholds
+    safe = u_max + error <= thresholds
+    return bool(np.all(collapsed | safe))
+
+
+def progressive_run(simulator_class, factors=(4, 2), steps=200, duration=None, thresholds=None, safety=2.0, **kwargs):
+    """
+        粗い解像度から順に計算し、各段階の結果を返すジェネレーター。最後は元の解像度（factor=1）で計算する。
+
+        thresholds を指定すると、2段階目以降で誤差の範囲内でも全ての倒壊判定が変わらなければ
+        そこで打ち切り、それより細かい計算を省く。
+
+        Yields:
+            dict: factor, u_max（元の解像度の (nx, ny)）, error（1段階前との差から見積もった誤差。最初の段階は None）,
+                  decided（thresholds 指定時、全ての判定が決まっているか）
+    """
+    duration = _duration(kwargs, steps, duration)
+    previous = None
+    for factor in tuple(factors) + (1,):
+        u_max = coarse_run(simulator_class, factor, duration=duration, **kwargs)
+        error = None if previous is None else estimate_error(u_max, previous, factor, safety=safety)
+        decided = None
+        if thresholds is not None and error is not None:
+            decided = decides_all(u_max, error, thresholds)
+        yield {"factor": factor, "u_max": u_max, "error": error, "decided": decided}
+        if decided:
+            return
+        previous = u_max
+
+
+if __name__ == "__main__":
+    import time
+
+    from EQSimulator import EQSimulatorVariableRho
+
+    grid_shape = (96, 96)
+    rho_map = np.random.uniform(0.5, 0.9, size=grid_shape)
+    thresholds = np.random.uniform(3.0, 20.0, size=grid_shape)
+    thresholds[np.random.random(grid_shape) < 0.95] = np.inf  # 建物のないマス
+
+    start = time.perf_counter()
+    for level in progressive_run(
+        EQSimulatorVariableRho, factors=(4, 2), steps=200, thresholds=thresholds,
+        epicenter=(40, 60), magnitude=7.5, grid_shape=grid_shape, rho_map=rho_map, mu=10.0, dt=0.05,
+    ):
+        error = "-" if level["error"] is None else f"{level['error'].max():.4f}"
+        print(f"factor={level['factor']}: {time.perf_counter() - start:.3f} s, 誤差の見積もり {error}, 判定済み {level['decided']}")
@@ -0,0 +1,58 @@
+## 単精度（float32）計算の精度確認
+# - 同じ条件のシミュレーションを倍精度と指定精度で実行し、u_max の誤差と倒壊判定の違いを数える
+import numpy as np
+
+
+def compare_precision(simulator_class, steps=200, thresholds=None, dtype=np.float32, rel_floor=1e-6, **kwargs):
+    """
+        simulator_class を倍精度と dtype で同じ条件（kwargs）で実行して結果を比べる
+
+        Parameters:
+            simulator_class: EQSimulatorVariableRho / TsunamiSimulatorVariableRho
+            steps (int): 計算するステップ数
+            thresholds (ndarray): 倒壊閾値（collapse_thresholds() の戻り値）。None なら判定の比較はしない
+            dtype: 比較する精度
+            rel_floor (float): 相対誤差を計算するマスの下限（倍精度の最大値に対する割合）
+            kwargs: コンストラクタの引数（dtype 以外）
+
+        Returns:
+            dict: max_rel_error（u_max の最大相対誤差）, max_abs_error, flipped（倒壊判定が変わったマス数）
+    """
+    reference = simulator_class(dtype=np.float64, **kwargs).run(steps=steps)
+    result = simulator_class(dtype=dtype, **kwargs).run(steps=steps).astype(np.float64)
+
+    abs_error = np.abs(result - reference)
+    significant = np.abs(reference) > rel_floor * np.abs(reference).max()
+    max_rel_error = (abs_error[significant] / np.abs(reference[significant])).max() if significant.any() else 0.0
+
+    flipped = 0
+    if thresholds is not None:
+        flipped = int(np.count_nonzero((result > thresholds) != (reference > thresholds)))
+
+    return {
+        "dtype": np.dtype(dtype).name,
+        "max_rel_error": float(max_rel_error),
+        "max_abs_error": float(abs_error.max()),
+        "flipped": flipped,
+    }
+
+
+if __name__ == "__main__":
+    from EQSimulator import EQSimulatorVariableRho
+    from TsunamiSimulator import TsunamiSimulatorVariableRho
+
+    grid_shape = (25, 25)
+    ground_map = np.random.uniform(0.5, 0.9, size=grid_shape)
+    thresholds = np.random.uniform(2.0, 10.0, size=grid_shape)
+
+    report = EQSimulatorVariableRho.precision_report(
+        steps=200, thresholds=thresholds,
+        epicenter=(12, 7), magnitude=7.5, grid_shape=grid_shape, rho_map=ground_map, mu=10.0, dt=0.05,
+    )
+    print("地震:", report)
+
+    report = TsunamiSimulatorVariableRho.precision_report(
+        steps=200, thresholds=thresholds,
+        wave_source=(12, 7), wave_height=7.5 * 1.5, grid_shape=grid_shape, spread_map=ground_map, mu=10.0, dt=0.05,
+    )
+    print("津波:", report)
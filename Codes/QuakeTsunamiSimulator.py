@@ -0,0 +1,66 @@
+## 地震と津波の同時シミュレーター
+# - 同じ震源から出る地震の揺れと津波を、(2, nx+2, ny+2) の1つの配列として同じステップで計算する
+# - メンバー0 が地震（地盤の脆さ rho_map）、メンバー1 が津波（波の伝わりやすさ spread_map）で、波速はメンバー毎
+# - 別々に計算する場合と結果は同じで、ステップ毎の Python の処理とメモリの走査が1回分で済む
+import numpy as np
+
+from EQSimulator import EQSimulatorVariableRho
+from TsunamiSimulator import TsunamiSimulatorVariableRho
+from WaveEngine import WaveEngine
+
+
+class QuakeTsunamiSimulator(WaveEngine):
+    QUAKE = 0
+    TSUNAMI = 1
+
+    def __init__(self, epicenter, magnitude, grid_shape, rho_map, spread_map, tsunami_scale=1.5, **kwargs):
+        """
+            震源 epicenter にマグニチュード magnitude の揺れと、magnitude × tsunami_scale の津波を与えて同時に計算する。
+            dt・mu などの条件は地震と津波で共通（その他の引数は WaveEngine を参照）。
+        """
+        super().__init__(
+            epicenter, [magnitude, magnitude * tsunami_scale], grid_shape, np.stack([rho_map, spread_map]), **kwargs
+        )
+
+    def collapse_thresholds(self, panel_manager):
+        """地震・津波それぞれの倒壊閾値を (2, nx, ny) の配列で返す（run() の thresholds にそのまま渡せる）"""
+        return np.stack([
+            EQSimulatorVariableRho.collapse_thresholds(panel_manager),
+            TsunamiSimulatorVariableRho.collapse_thresholds(panel_manager),
+        ])
+
+    def update_panels(self, panel_manager):
+        """
+            地震 → 津波の順に、それぞれのシミュレーターと同じ基準でパネルの情報と建物の倒壊判定を更新する
+
+            Returns:
+                panel_manager: 更新後のパネル情報を持つPanelManagerオブジェクト
+        """
+        u_max = self.u_max[self.interior]
+        panel_manager = EQSimulatorVariableRho.apply_to_panels(panel_manager, u_max[self.QUAKE])
+        return TsunamiSimulatorVariableRho.apply_to_panels(panel_manager, u_max[self.TSUNAMI])
+
+
+if __name__ == "__main__":
+    import time
+
+    grid_shape = (200, 200)
+    rho_map = np.random.uniform(0.5, 0.9, size=grid_shape)
+    spread_map = np.random.uniform(0.8, 1.2, size=grid_shape)
+    conditions = dict(grid_shape=grid_shape, mu=10.0, dt=0.05)
+
+    start = time.perf_counter()
+    quake = EQSimulatorVariableRho(epicenter=(40, 60), magnitude=7.5, rho_map=rho_map, **conditions).run(steps=200)
+    tsunami = TsunamiSimulatorVariableRho(
+        wave_source=(40, 60), wave_height=7.5 * 1.5, spread_map=spread_map, **conditions
+    ).run(steps=200)
+    separate = time.perf_counter() - start
+
+    start = time.perf_counter()
+    fused = QuakeTsunamiSimulator(
+        epicenter=(40, 60), magnitude=7.5, rho_map=rho_map, spread_map=spread_map, **conditions
+    ).run(steps=200)
+    together = time.perf_counter() - start
+
+    print(f"別々: {separate:.3f} s, 同時: {together:.3f} s")
+    print("差:", np.abs(fused[0] - quake).max(), np.abs(fused[1] - tsunami).max())
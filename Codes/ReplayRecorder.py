@@ -0,0 +1,92 @@
+## リプレイ用のフレーム記録
+# - stride ステップ毎の場を int8 / int16 に量子化し、事前に確保したリングバッファに保存する
+# - 量子化の倍率はフレーム毎に決める（最大振幅がその型の最大値になるようにする）
+# - バッファはメモリ上限（max_bytes）から確保できる枚数だけ持ち、一杯になったら古いフレームから上書きする
+import numpy as np
+
+
+class ReplayRecorder:
+    """
+        シミュレーション中の場を量子化して記憶しておき、後から任意のフレームをすぐに取り出せるようにする。
+
+        使い方:
+            recorder = ReplayRecorder(sim.grid_shape, stride=5)
+            sim.run(steps=200, recorder=recorder)
+            for step, field in recorder:
+                ...
+    """
+
+    def __init__(self, frame_shape, stride=1, dtype=np.int8, max_bytes=64 * 2 ** 20, capacity=1000):
+        """
+            Parameters:
+                frame_shape (tuple): 記録する場の形状（マップ範囲の (nx, ny)）
+                stride (int): 何ステップ毎に記録するか
+                dtype: 量子化した値の型（np.int8 か np.int16）
+                max_bytes (int): バッファに使うメモリの上限
+                capacity (int): 記録するフレーム数の上限（max_bytes に収まらない場合は収まる枚数。None ならメモリの上限まで）
+        """
+        self.dtype = np.dtype(dtype)
+        if self.dtype not in (np.dtype(np.int8), np.dtype(np.int16)):
+            raise ValueError(f"dtype は np.int8 か np.int16 を指定してください。指定値: {dtype}")
+        if stride < 1:
+            raise ValueError(f"stride は1以上を指定してください。指定値: {stride}")
+        self.frame_shape = tuple(frame_shape)
+        self.stride = stride
+        self.levels = np.iinfo(self.dtype).max
+
+        # 1フレームあたり: 量子化した場 + 倍率 (float64) + ステップ数 (int64)
+        frame_bytes = int(np.prod(self.frame_shape)) * self.dtype.itemsize + 16
+        fits = max_bytes // frame_bytes
+        if fits < 1:
+            raise ValueError(f"max_bytes={max_bytes} では1フレーム（{frame_bytes} バイト）も記録できません。")
+        self.capacity = int(fits if capacity is None else min(capacity, fits))
+
+        self.frames = np.zeros((self.capacity,) + self.frame_shape, dtype=self.dtype)
+        self.scales = np.zeros(self.capacity)
+        self.steps = np.full(self.capacity, -1, dtype=np.int64)
+        self._buffer = np.zeros(self.frame_shape)  # 量子化の作業用
+        self._next = 0  # 次に書き込む位置
+        self.count = 0  # 記録済みのフレーム数（capacity まで）
+
+    @property
+    def nbytes(self):
+        """バッファが使っているメモリ量"""
+        return self.frames.nbytes + self.scales.nbytes + self.steps.nbytes
+
+    def record(self, step, field):
+        """step 番目の場 field を量子化して記録する（一杯なら一番古いフレームを上書きする）"""
+        peak = np.max(np.abs(field))
+        scale = peak / self.levels if peak > 0 else 1.0
+        np.divide(field, scale, out=self._buffer)
+        np.rint(self._buffer, out=self._buffer)
+        self.frames[self._next] = self._buffer
+        self.scales[self._next] = scale
+        self.steps[self._next] = step
+        self._next = (self._next + 1) % self.capacity
+        self.count = min(self.count + 1, self.capacity)
+
+    def _slot(self, index):
+        """古い順に index 番目のフレームのバッファ上の位置"""
+        if not -self.count <= index < self.count:
+            raise IndexError(f"記録済みのフレームは {self.count} 枚です。指定値: {index}")
+        index %= self.count
+        oldest = (self._next - self.count) % self.capacity
+        return (oldest + index) % self.capacity
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, index):
+        """古い順に index 番目のフレームを (ステップ数, 場) で返す（場は量子化を戻した float64）"""
+        slot = self._slot(index)
+        return int(self.steps[slot]), self.frames[slot] * self.scales[slot]
+
+    def __iter__(self):
+        for index in range(self.count):
+            yield self[index]
+
+    def clear(self):
+        """記録を全て消す（バッファはそのまま使い回す）"""
+        self._next = 0
+        self.count = 0
+        self.steps.fill(-1)
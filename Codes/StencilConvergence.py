@@ -0,0 +1,80 @@
+## 2次精度と4次精度のステンシルの収束比較
+# - 一辺 25 のマップを様々なグリッド数で計算し、非常に細かいグリッドの結果との u_max の誤差を比べる
+# - 点震源はグリッドに依存するので、幅を持ったガウス型の初期変位を使う
+# - 壁からの反射が入らないよう、マップの2倍の範囲を計算してマップ部分だけを比べる
+# - 震源付近の u_max は最初のステップの値で決まり（時間刻みの誤差）、ステンシルの比較にならないので、
+#   波面が届いて最大値になる「震源から 3σ 以上離れたマス」で誤差を測る
+# - 波速と dt の比（c·dt/dx）はゲームの設定（mu=10, 脆さ 0.7, dt=0.05, dx=1）に合わせる
+import numpy as np
+from scipy.ndimage import map_coordinates
+
+from EQSimulator import EQSimulatorVariableRho
+
+MAP_SIZE = 25.0                  # マップの一辺（現在の解像度では dx = 1）
+DOMAIN = 2 * MAP_SIZE            # 計算範囲の一辺
+DURATION = 3.0                   # 計算する物理時間
+MU = 10.0
+RHO = 0.7
+SIGMA = 2.0                      # 初期変位の幅
+COURANT = np.sqrt(MU / RHO) * 0.05  # c·dt/dx
+
+
+def simulate(n, order):
+    """計算範囲を一辺 n マスで計算した u_max を返す"""
+    dx = DOMAIN / n
+    c = np.sqrt(MU / RHO)
+    steps = int(np.ceil(DURATION / (COURANT * dx / c)))
+    sim = EQSimulatorVariableRho(
+        epicenter=(0, 0), magnitude=0.0, grid_shape=(n, n), rho_map=np.full((n, n), RHO),
+        dx=dx, dt=DURATION / steps, mu=MU, order=order,
+    )
+    centers = (np.arange(n) + 0.5) * dx - DOMAIN / 2
+    r2 = centers[:, None] ** 2 + centers[None, :] ** 2
+    sim.set_field(np.exp(-r2 / (2 * SIGMA ** 2)))
+    return sim.run(steps=steps)
+
+
+def sample(u_max, points):
+    """u_max（セル中心の値）を物理座標 points の格子点で3次補間する"""
+    n = u_max.shape[0]
+    index = points / (DOMAIN / n) - 0.5
+    grid = np.meshgrid(index, index, indexing="ij")
+    return map_coordinates(u_max, grid, order=3, mode="nearest")
+
+
+def convergence_study(sizes=(8, 10, 12, 14, 16, 18, 20, 25), reference_size=200):
+    """
+        マップの一辺あたりのマス数 n 毎に、2次・4次精度の誤差を返す。
+        誤差は各グリッド自身のセル中心で、参照解（4次精度・一辺 reference_size マス）の最大値に対する最大誤差。
+
+        Returns:
+            dict: {(order, n): error}
+    """
+    scale = DOMAIN / MAP_SIZE
+    reference = simulate(int(reference_size * scale), order=4)
+    errors = {}
+    for n in sizes:
+        points = (np.arange(int(n * scale)) + 0.5) * (MAP_SIZE / n)
+        distance = np.hypot(points[:, None] - DOMAIN / 2, points[None, :] - DOMAIN / 2)
+        target = (distance > 3 * SIGMA) & (distance < MAP_SIZE / 2)
+        expected = sample(reference, points)
+        for order in (2, 4):
+            error = np.abs(simulate(len(points), order) - expected)
+            errors[order, n] = error[target].max() / np.abs(expected[target]).max()
+    return errors
+
+
+if __name__ == "__main__":
+    base_n = 25
+    sizes = (8, 10, 12, 14, 16, 18, 20, 25)
+    errors = convergence_study(sizes=sizes)
+
+    print(" n    2次      4次")
+    for n in sizes:
+        print(f"{n:3d}  {errors[2, n]:.4f}  {errors[4, n]:.4f}")
+
+    target = errors[2, base_n]
+    matching = [n for n in sizes if errors[4, n] <= target]
+    print(f"2次精度 n={base_n} の誤差: {target:.4f}")
+    if matching:
+        print(f"4次精度で同じ誤差以下になる最小のグリッド: n={min(matching)}")
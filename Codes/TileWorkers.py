@@ -0,0 +1,174 @@
+## 波動計算のタイル並列（プロセス版）
+# - 場・係数の配列を multiprocessing.shared_memory に置き、行方向のタイルを常駐のワーカープロセスで更新する
+# - 各ワーカーは自分のタイルの行だけを書き、隣のタイルとの境界（ステンシルの幅の行）は共有の u_curr から直接読む
+#   （ステップ毎の同期で境界の値が書き終わっていることを保証するので、境界の交換はコピーなしで済む）
+# - 更新は WaveEngine._update_region() そのものを同じ行範囲で呼ぶので、結果は workers=1 と完全に一致する
+# - スレッド版（ThreadPoolExecutor）と違い GIL や NumPy の演算以外の Python の処理に縛られない
+import multiprocessing
+import weakref
+from multiprocessing import shared_memory
+
+import numpy as np
+
+# 共有メモリに置く配列（ステップ毎に書き換わる場と、_update_region() が読む係数）
+SHARED_ARRAYS = ("u_prev", "u_curr", "u_next", "u_max", "_lap", "_stencil_coef", "_center", "damping", "sponge_a", "sponge_b")
+# ワーカーに渡す設定
+SETTINGS = ("backend", "order", "absorbing_width", "_damped")
+# ローテーションする3本のバッファ
+BUFFERS = ("u_prev", "u_curr", "u_next")
+
+
+def _view(block, shape, dtype):
+    """
+        共有メモリ上の配列を作る。np.frombuffer はバッファを保持するので、
+        ビューが残っている間は SharedMemory.close() が BufferError になり、使用中のメモリが解放されない。
+    """
+    return np.frombuffer(block.buf, dtype=dtype, count=int(np.prod(shape))).reshape(shape)
+
+
+class _SharedBlock(shared_memory.SharedMemory):
+    """
+        ビューが残っていれば閉じずにおく SharedMemory。
+        呼び出し側がまだビュー（run() の戻り値など）を持っている場合、マッピングはそのビューが持っていて、
+        ビューがなくなったときに解放される（SharedMemory.__del__ のように BufferError を出さない）。
+    """
+
+    def close(self):
+        try:
+            super().close()
+        except BufferError:
+            pass
+
+
+def _close(blocks):
+    """共有メモリを閉じる（ビューが残っているものは、ビューがなくなったときに解放される）"""
+    for block in blocks:
+        block.close()
+
+
+def _attach(specs):
+    """共有メモリの名前・形状・型から配列のビューを作る（SharedMemory も返して開いたままにする）"""
+    blocks, arrays = [], {}
+    for name, (shm_name, shape, dtype) in specs.items():
+        block = _SharedBlock(name=shm_name)
+        blocks.append(block)
+        arrays[name] = _view(block, shape, dtype)
+    return blocks, arrays
+
+
+def _worker(engine_class, specs, settings, conn):
+    """
+        ワーカープロセスの本体。
+        (バッファの並び, i0, i1, j0, j1) を受け取る度にその行範囲を更新して返事をし、None で終了する。
+    """
+    blocks, arrays = _attach(specs)
+    # 計算に使う属性だけを持ったエンジン（__init__ は呼ばない）
+    tile = engine_class.__new__(engine_class)
+    tile.__dict__.update(settings)
+    tile.__dict__.update(arrays)
+    tile.sponge_a = arrays.get("sponge_a")
+    tile.sponge_b = arrays.get("sponge_b")
+    tile._views = {}
+    buffers = [arrays[name] for name in BUFFERS]
+    try:
+        while True:
+            message = conn.recv()
+            if message is None:
+                break
+            order, i0, i1, j0, j1 = message
+            tile.u_prev, tile.u_curr, tile.u_next = (buffers[k] for k in order)
+            try:
+                tile._update_region(i0, i1, j0, j1)
+            except Exception as error:
+                conn.send(error)
+            else:
+                conn.send(None)
+    finally:
+        tile._views = {}
+        del tile, buffers, arrays
+        _close(blocks)
+
+
+def _release(connections, processes, blocks):
+    """ワーカーを止めて共有メモリを解放する（shutdown() と、エンジンが破棄されたときの weakref.finalize から呼ぶ）"""
+    for conn in connections:
+        try:
+            conn.send(None)
+        except (BrokenPipeError, OSError):
+            pass
+    for process in processes:
+        process.join()
+    for conn in connections:
+        conn.close()
+    for block in blocks:
+        block.unlink()
+    _close(blocks)
+
+
+class SharedTilePool:
+    """
+        WaveEngine の場と係数を共有メモリに移し、workers 個のプロセスで行方向のタイルを並列に更新する。
+
+        作成時にエンジンの配列を共有メモリ上のビューに置き換える（値はそのまま）。
+        shutdown() でワーカーを止め、配列を通常のメモリに戻してから共有メモリを解放する。
+        shutdown() を呼ばずにエンジンが破棄された場合（とインタープリターの終了時）も、
+        weakref.finalize でワーカーを止めて共有メモリを解放する。
+    """
+
+    def __init__(self, engine, workers):
+        self.workers = workers
+        self._blocks = {}
+        specs = {}
+        for name in SHARED_ARRAYS:
+            value = getattr(engine, name, None)
+            if value is None:
+                continue
+            block = _SharedBlock(create=True, size=max(value.nbytes, 1))
+            view = _view(block, value.shape, value.dtype)
+            view[...] = value
+            setattr(engine, name, view)
+            self._blocks[name] = block
+            specs[name] = (block.name, value.shape, value.dtype.str)
+        # 古い配列を指すビューは捨てる
+        engine._views = {}
+        # バッファ → 共有メモリ上の番号（ローテーション後の並びをワーカーに伝えるのに使う）
+        self._buffer_index = {id(getattr(engine, name)): k for k, name in enumerate(BUFFERS)}
+
+        settings = {name: getattr(engine, name) for name in SETTINGS}
+        self._connections = []
+        self._processes = []
+        for _ in range(workers):
+            parent, child = multiprocessing.Pipe()
+            process = multiprocessing.Process(target=_worker, args=(type(engine), specs, settings, child), daemon=True)
+            process.start()
+            child.close()
+            self._connections.append(parent)
+            self._processes.append(process)
+        # エンジンへの参照は持たせない（持たせるとエンジンが破棄されなくなる）
+        self._finalizer = weakref.finalize(
+            engine, _release, self._connections, self._processes, list(self._blocks.values())
+        )
+
+    def owns(self, engine):
+        """エンジンの3本のバッファがこのプールの共有メモリか（fork() などで差し替わっていないか）"""
+        return all(id(getattr(engine, name)) in self._buffer_index for name in BUFFERS)
+
+    def update(self, engine, edges, j0, j1):
+        """edges で区切った各タイル（行 edges[k]〜edges[k+1]）をワーカーで更新し、全て終わるまで待つ"""
+        order = tuple(self._buffer_index[id(getattr(engine, name))] for name in BUFFERS)
+        tiles = list(zip(edges[:-1], edges[1:]))
+        for conn, (a, b) in zip(self._connections, tiles):
+            conn.send((order, int(a), int(b), j0, j1))
+        # 全タイルの返事を受け取るまでがステップ間の同期点（次のステップは境界の行が書き終わってから読む）
+        errors = [conn.recv() for conn in self._connections[:len(tiles)]]
+        for error in errors:
+            if error is not None:
+                raise error
+
+    def shutdown(self, engine):
+        """ワーカーを止め、エンジンの配列を通常のメモリにコピーしてから共有メモリを解放する"""
+        for name in self._blocks:
+            setattr(engine, name, np.array(getattr(engine, name)))
+        engine._views = {}
+        self._blocks = {}
+        self._finalizer()
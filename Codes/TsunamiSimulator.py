@@ -1,110 +1,131 @@
 import numpy as np
-import os
-import matplotlib.pyplot as plt
-
-class TsunamiSimulatorVariableRho:
-    def __init__(
-        self, wave_source, wave_height, grid_shape, spread_map,
-        dx=1.0, dt=0.1, mu=1.0, damping_width=1, save_frames=False
-    ):
-        self.grid_shape = grid_shape
-        self.nx, self.ny = grid_shape
-        self.dx = dx
-        self.dt = dt
-        self.mu = mu
-        self.save_frames = save_frames
-
-        # パディング付きの形状
-        padded_shape = (self.nx + 2, self.ny + 2)
-
-        self.u_prev = np.zeros(padded_shape)
-        self.u_curr = np.zeros(padded_shape)
-        self.u_max = np.zeros(padded_shape)
-
-        # 波の伝わりやすさ（小さい＝遅い、大きい＝速い）
-        self.spread = np.pad(spread_map, pad_width=1, mode='edge')
-
-        # 発生源（津波震源）
-        x0, y0 = wave_source
-        self.u_curr[x0 + 1, y0 + 1] = wave_height
-
-        # 境界減衰
-        self.damping = self._create_damping_mask(padded_shape, damping_width)
-
-    def _create_damping_mask(self, shape, width):
-        nx, ny = shape
-        damping = np.ones(shape)
-        for i in range(width):
-            factor = (1 - i / width) ** 2
-            damping[i, :] *= factor
-            damping[-i - 1, :] *= factor
-            damping[:, i] *= factor
-            damping[:, -i - 1] *= factor
-        return damping
-
-    def laplacian(self, u):
-        lap = np.zeros_like(u)
-        lap[1:-1, 1:-1] = (
-            -4 * u[1:-1, 1:-1]
-            + u[0:-2, 1:-1]
-            + u[2:, 1:-1]
-            + u[1:-1, 0:-2]
-            + u[1:-1, 2:]
-        ) / (self.dx ** 2)
-        return lap
-
-    def step(self):
-        # 津波の波速（spread_map で変動）
-        c = np.sqrt(self.mu / self.spread)
-
-        lap = self.laplacian(self.u_curr)
-
-        u_next = (
-            2 * self.u_curr - self.u_prev
-            + (c ** 2) * (self.dt ** 2) * lap
-        )
-
-        # 境界の波を弱める
-        u_next *= self.damping
-
-        # 最大波高の記録
-        self.u_max = np.maximum(self.u_max, np.abs(u_next))
-
-        self.u_prev = self.u_curr
-        self.u_curr = u_next
-
-    def save_frame(self, step, output_dir="frames"):
-        os.makedirs(output_dir, exist_ok=True)
-        trimmed_u = self.u_curr[1:-1, 1:-1]
-
-        plt.figure(figsize=(6, 5))
-        plt.imshow(trimmed_u, cmap="Blues", vmin=0, vmax=np.max(trimmed_u))
-        plt.colorbar(label="Water Level (m)")
-        plt.title(f"Tsunami Step {step}")
-        plt.axis("off")
-        plt.tight_layout()
-        plt.savefig(f"{output_dir}/frame_{step:05d}.png")
-        plt.close()
-
-    def run(self, steps=200, save_interval=10, output_dir="frames"):
-        for step in range(steps):
-            self.step()
-            if self.save_frames and step % save_interval == 0:
-                self.save_frame(step, output_dir)
-        return self.u_max[1:-1, 1:-1]
-
-    # パネル情報の更新（シミュレーション実行後の呼び出しを想定）
-    def update_panels(self, panel_manager):
+
+import FrameWriter
+import MultiResolution
+from WaveEngine import WaveEngine
+
+class TsunamiSimulatorVariableRho(WaveEngine):
+    # 耐性: 建物の強さ × 係数
+    COLLAPSE_ALPHA = 5.0 # 調整用係数
+
+    # フレーム画像・動画の描画設定
+    FRAME_STYLE = {"cmap": "Blues", "label": "Water Level (m)", "title": "Tsunami Step {step}", "symmetric": False}
+
+    # コンストラクタの引数名（MultiResolution で粗いグリッド用の引数を作るときに使う）
+    SOURCE_ARG = "wave_source"
+    AMPLITUDE_ARG = "wave_height"
+    MAP_ARG = "spread_map"
+
+    # masked=True で計算対象のマスがこの割合未満なら疎行列（engine="sparse"）で計算する
+    # （それ以上なら全域を計算して対象外の係数を0にする方が速い）
+    SPARSE_FRACTION = 0.15
+
+    def __init__(self, wave_source, wave_height, grid_shape, spread_map, masked=False, runup_width=1, **kwargs):
+        """
+            津波の発生地点 wave_source (x, y) に初期波高 wave_height を与え、spread_map の上で伝える
+            （波速 c = sqrt(mu / spread)）。
+
+            masked=True の場合、水のマス（spread > 0）と、そこから runup_width マス以内の陸（遡上域）だけで
+            波を伝え、それ以外の陸は波を通さない壁として扱う（spread = 0 の陸で mu / spread が0除算になるのを避ける）。
+            遡上域の陸には一番近い水のマスの spread を使う。
+            計算対象のマスが SPARSE_FRACTION 未満のステージでは engine="sparse" の通し番号の配列で対象のマスだけを計算し、
+            それ以外は全域を計算して対象外のマスの係数を0にする（engine を指定した場合はそちらを使う）。
+
+            その他の引数（dx, dt, mu, absorbing_width, workers, backend, engine, order など）は WaveEngine を参照。
+        """
+        if masked:
+            if "active_mask" in kwargs:
+                raise ValueError("masked=True では active_mask は指定できません（水のマスから自動で決めます）。")
+            spread_map, kwargs["active_mask"] = self.water_mask(spread_map, runup_width)
+            if "engine" not in kwargs:
+                kwargs["engine"] = "sparse" if np.mean(kwargs["active_mask"]) < self.SPARSE_FRACTION else "dense"
+        self.masked = masked
+        super().__init__(wave_source, wave_height, grid_shape, spread_map, **kwargs)
+        # 波の伝わりやすさ（パディング込み）
+        self.spread = self.medium
+
+    @staticmethod
+    def water_mask(spread_map, runup_width=1):
+        """
+            水のマス（spread > 0）から runup_width マス以内を計算対象のマスとして返す。
+
+            Returns:
+                filled (ndarray): 陸のマスを一番近い水のマスの spread で埋めた spread_map（0除算しない）
+                mask (ndarray): 計算対象（水のマス＋遡上域）なら True の bool 配列
+        """
+        from scipy import ndimage
+
+        spread_map = np.asarray(spread_map)
+        wet = np.isfinite(spread_map) & (spread_map > 0)
+        if not np.any(wet):
+            raise ValueError("spread_map に水のマス（spread > 0）がありません。")
+        mask = ndimage.binary_dilation(wet, iterations=runup_width) if runup_width > 0 else wet
+        nearest = ndimage.distance_transform_edt(~wet, return_distances=False, return_indices=True)
+        return spread_map[tuple(nearest)], mask
+
+    @classmethod
+    def run_multirate(cls, duration, dt="auto", coarsen=1, thresholds=None, **kwargs):
+        """
+            地震とは別の時間刻み（と、必要なら粗いグリッド）で物理時間 duration の津波を計算し、
+            パネルのグリッドでの波の最大値を返す（update_panels() の max_wave にそのまま渡せる）。
+
+            津波は地震より遅いので、dt="auto" なら津波自身の波速の CFL 条件で決まる大きな dt で計算できる。
+            coarsen > 1 の場合は coarsen×coarsen マスをまとめたグリッドで計算し（dx も coarsen 倍になるので
+            dt もさらに大きくなる）、結果を各マスに複製して元のグリッドに戻す（MultiResolution.coarse_run() 参照）。
+            thresholds は coarsen=1 の場合だけ早期終了に使う。
+
+            1マスの点震源は格子の細かさの成分が中心なので、u_max は dt（クーラン数）で大きく変わる
+            （dt を2倍にすると遠方の u_max はおよそ半分）。dt・coarsen を変える場合は wave_height や
+            倒壊の係数を合わせて調整する。
+
+            Parameters:
+                duration (float): 計算する物理時間（地震側の steps × dt と揃える）
+                dt: 津波の時間刻み（"auto" なら CFL 条件から決める）
+                coarsen (int): グリッドの縮小率
+                thresholds (ndarray): 倒壊閾値（collapse_thresholds() 参照）
+                kwargs: コンストラクタの引数（wave_source, wave_height, grid_shape, spread_map など）
+        """
+        return MultiResolution.coarse_run(cls, coarsen, duration=duration, thresholds=thresholds, dt=dt, **kwargs)
+
+    @classmethod
+    def collapse_thresholds(cls, panel_manager):
+        """
+            update_panels() と同じ基準で、各マスの建物が倒壊する揺れの閾値を (nx, ny) の配列で返す。
+            建物のないマスは np.inf（run() の thresholds にそのまま渡せる）
+        """
+        panels = panel_manager.get_all_panels()
+        thresholds = np.full((panel_manager.tile_width, panel_manager.tile_height), np.inf)
+        for x in range(panel_manager.tile_width):
+            for y in range(panel_manager.tile_height):
+                panel = panels[x, y]
+                if panel.building_type < 0:
+                    continue
+                resistance = panel.building_strength * cls.COLLAPSE_ALPHA
+                thresholds[x, y] = resistance
+        return thresholds
+
+    def update_panels(self, panel_manager, member=0, max_wave=None):
         """
             シミュレーション結果に基づき、パネルの波の大きさ情報と建物の倒壊判定を更新する
             
             Parameters:
                 panel_manager (PanelManager): パネル管理オブジェクト
+                member (int): アンサンブル実行時に使うメンバー番号
+                max_wave (ndarray): 波の最大値の配列。指定時はシミュレーション結果の代わりに使う
+                                    （MultiResolution のプレビュー結果など）
 
             Returns:
                 panel_manager: 更新後のパネル情報を持つPanelManagerオブジェクト
         """
-        max_wave = self.u_max[1:-1, 1:-1]
+        if max_wave is None:
+            max_wave = self.u_max[self.interior]
+            if self.batched:
+                max_wave = max_wave[member]
+        return self.apply_to_panels(panel_manager, max_wave)
+
+    @classmethod
+    def apply_to_panels(cls, panel_manager, max_wave):
+        """波の最大値の配列 max_wave で、パネルの波の大きさ情報と建物の倒壊判定を更新する"""
         panels = panel_manager.get_all_panels()
 
         if max_wave.shape != (panel_manager.tile_width, panel_manager.tile_height):
@@ -123,9 +144,8 @@ class TsunamiSimulatorVariableRho:
                     panels[x, y] = panel
                     continue
 
-                # 耐震性: 建物の強さ × 地盤の強さ × 係数
-                alpha = 5.0 # 調整用係数
-                resistance = panel.building_strength * alpha
+                # 耐性: 建物の強さ × 係数
+                resistance = panel.building_strength * cls.COLLAPSE_ALPHA
 
                 # 建物あり & 揺れ > 耐震性 → 壊れる
                 if waving > resistance:
@@ -139,16 +159,12 @@ class TsunamiSimulatorVariableRho:
 
 ### 動画作成（地震コードと同じ）
 def make_video_from_frames(frame_dir="frames", output_path="tsunami.mp4", fps=10):
-    import imageio
-    files = sorted([os.path.join(frame_dir, f) for f in os.listdir(frame_dir) if f.endswith(".png")])
-    images = [imageio.imread(f) for f in files]
-    imageio.mimsave(output_path, images, fps=fps)
+    # 1枚ずつ読み込んでエンコーダに渡す（全フレームをメモリに載せない）
+    FrameWriter.make_video_from_frames(frame_dir, output_path, fps=fps)
 
 
 
 if __name__ == "__main__":
-    import imageio
-
     # デバッグ用にシンプルなサイズ
     tile_width  = 50
     tile_height = 50
@@ -156,21 +172,21 @@ if __name__ == "__main__":
     # 波の伝わりやすさ（均一）
     spread = np.ones((tile_width, tile_height)) * 1.0
 
-    sim = TsunamiSimulator(
+    sim = TsunamiSimulatorVariableRho(
         wave_source=(25, 25),   # 津波発生地点（中央）
         wave_height=5.0,        # 初期波高
         grid_shape=(tile_width, tile_height),
         spread_map=spread,      # 波の伝わりやすさ
         mu=1.0,
-        dt=0.3,
+        dt="auto",              # CFL 条件から自動決定
         save_frames=True
     )
 
     # フレーム出力先
     output_dir = "./tsunami_frames"
 
-    # 200ステップ実行、10ステップごとに画像保存
-    sim.run(steps=200, save_interval=10, output_dir=output_dir)
+    # 物理時間 60 の間実行、10ステップごとに画像保存
+    sim.run(duration=60.0, save_interval=10, output_dir=output_dir)
 
     # 動画生成
     make_video_from_frames(
@@ -0,0 +1,81 @@
+## 津波の発生地点の事前チェック
+# - 水のマス（spread > 0）と遡上域のマスを連結成分に分け、ステージ毎に一度だけ計算しておく
+# - 震源がどの水域にもつながっていなければ、津波のシミュレーションを丸ごと省ける
+# - min_size マス未満の水域（内陸の小さな池など）からは津波を起こさない
+# - 一番近い水のマスも事前に求めておくので、発生地点を海に移す場合も配列を1回引くだけで済む
+import numpy as np
+from scipy import ndimage
+
+from TsunamiSimulator import TsunamiSimulatorVariableRho
+
+
+class WaterConnectivity:
+    """
+        ステージの水域（水のマス＋遡上域）の連結成分と、各マスから一番近い（津波を起こせる水域の）水のマスを保持する。
+
+        使い方:
+            connectivity = WaterConnectivity(permeability_map)
+            source = connectivity.tsunami_source(epicenter, max_distance=2)
+            if source is None:
+                ...  # 津波は発生しない
+    """
+
+    def __init__(self, spread_map, runup_width=1, min_size=1):
+        """
+            Parameters:
+                spread_map (ndarray): 波の伝わりやすさ（TsunamiSimulatorVariableRho の spread_map と同じもの）
+                runup_width (int): 水のマスから何マス先の陸まで遡上域とするか（masked=True の runup_width と揃える）
+                min_size (int): 津波を起こせる水域の最小の水のマス数（これより小さい池などは水域外として扱う）
+        """
+        spread_map = np.asarray(spread_map)
+        self.runup_width = runup_width
+        self.min_size = min_size
+        self.wet = np.isfinite(spread_map) & (spread_map > 0)
+        if np.any(self.wet):
+            _, self.mask = TsunamiSimulatorVariableRho.water_mask(spread_map, runup_width)
+        else:
+            self.mask = self.wet
+
+        # 波が伝わる範囲（5点ステンシルと同じ上下左右のつながり）。0 は水域外
+        self.labels, self.n_components = ndimage.label(self.mask)
+        # 水域毎の水のマス数（遡上域の陸は数えない）と、津波を起こせる（min_size 以上の）水域
+        self.sizes = np.bincount(self.labels[self.wet], minlength=self.n_components + 1)
+        self.sizes[0] = 0
+        self.large = self.sizes >= max(min_size, 1)
+        self.source_water = self.wet & self.large[self.labels]
+
+        if np.any(self.source_water):
+            # 各マスから一番近い（津波を起こせる水域の）水のマスとその距離（マス数）
+            self.distance, nearest = ndimage.distance_transform_edt(~self.source_water, return_indices=True)
+            self.nearest = np.stack(nearest, axis=-1)
+        else:
+            # 津波を起こせる水域のないステージ: どこからも津波は伝わらない
+            self.distance = np.full(self.wet.shape, np.inf)
+            self.nearest = np.zeros(self.wet.shape + (2,), dtype=int)
+
+    def component(self, cell):
+        """マス cell (x, y) が属する水域の番号（水域外なら 0）"""
+        x, y = cell
+        return int(self.labels[x, y])
+
+    def is_connected(self, cell):
+        """マス cell (x, y) から津波が伝わるか（min_size 以上の水域の水のマスか遡上域にあるか）"""
+        return bool(self.large[self.component(cell)])
+
+    def nearest_water(self, cell):
+        """マス cell (x, y) から一番近い（min_size 以上の水域の）水のマスの座標とそこまでの距離（マス数）"""
+        x, y = cell
+        return tuple(int(v) for v in self.nearest[x, y]), float(self.distance[x, y])
+
+    def tsunami_source(self, epicenter, max_distance=0):
+        """
+            震源 epicenter から津波を発生させる地点を返す。
+
+            震源が（min_size 以上の）水域にあればそのまま、そうでなければ max_distance マス以内の
+            一番近い（min_size 以上の水域の）水のマスを返す。
+            どちらでもなければ None（津波のシミュレーションは不要）。
+        """
+        if self.is_connected(epicenter):
+            return tuple(epicenter)
+        cell, distance = self.nearest_water(epicenter)
+        return cell if distance <= max_distance else None
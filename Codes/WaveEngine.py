@@ -0,0 +1,922 @@
+## 地震・津波シミュレーター共通の波動計算エンジン
+# - 2次元の波動方程式 u_tt = c² ∇²u を中心差分（リープフロッグ）で時間発展させる
+# - EQSimulatorVariableRho / TsunamiSimulatorVariableRho は、このエンジンに震源と媒質マップを渡す薄い設定クラス
+# - 媒質マップを (メンバー数, nx, ny) で渡すと、メンバー毎に波速の違う場を1つの配列でまとめて計算できる
+#   （QuakeTsunamiSimulator で地震と津波を同時に計算するのに使う）
+import copy
+import functools
+import numpy as np
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import FrameWriter
+import PrecisionCheck
+import TileWorkers
+import WaveKernels
+
+class WaveEngine:
+    # フレーム画像・動画の描画設定（サブクラスで上書きする）
+    FRAME_STYLE = {"cmap": "seismic", "label": "Displacement", "title": "Step {step}", "symmetric": True}
+
+    def __init__(
+        self, sources, amplitudes, grid_shape, medium_map,
+        dx=1.0, dt=0.1, mu=1.0, damping_width=1, save_frames=False, active_window=True,
+        absorbing_width=0, absorbing_strength=2.0, cfl=0.9, workers=1, parallel="thread",
+        backend="numpy", dtype=np.float64, engine="dense", active_mask=None,
+        order=2, stations=None, station_stride=1, track_timing=False, arrival_threshold=1e-3,
+        frame_processes=0
+    ):
+        """
+            sources に発生源の座標 (x, y)、amplitudes に初期振幅を渡す。
+            波速は c² = mu / medium_map（medium_map が大きいほど波が遅い）。
+
+            sources に座標 (x, y) のリスト、amplitudes に同じ長さの配列を渡すと、
+            N 個の発生源をまとめて (N, nx+2, ny+2) の配列として同時に計算する（アンサンブル実行）。
+            amplitudes がスカラーの場合は全ての発生源に同じ値を使う。
+            medium_map を (N, nx, ny) で渡すと、メンバー毎に別の波速で計算する
+            （発生源が1つならその発生源を全メンバーで使う）。
+
+            active_window=True の場合、波が届いている範囲（非ゼロ領域の外接矩形）だけを計算する。
+            5点ステンシルでは波は1ステップに1マスしか広がらないので、結果は全域計算と一致する。
+
+            absorbing_width > 0 の場合、マップの外側に absorbing_width マスの吸収層（スポンジ層）を追加する。
+            吸収層では減衰係数を外側ほど強く（2乗で）かけるので、境界での反射がほぼなくなり、
+            反射を避けるためにマップより広い範囲を計算する必要がなくなる。
+            absorbing_strength は吸収層全体での減衰の強さ（最外周の γ を c_max / (幅·dx) で割った値）。
+
+            dt="auto" の場合、最大波速から CFL 条件で安定な最大の dt に cfl（安全係数）を掛けた値を使う。
+            dt を数値で指定した場合も CFL 条件を確認し、不安定になる場合は警告を表示する。
+
+            workers > 1 の場合、計算範囲を行方向のタイルに分割してスレッドプールで並列に更新する。
+            各タイルは共有のバッファを直接読み書きし（隣のタイルとの境界1マスもそのまま参照できる）、
+            マス毎の計算順序は変わらないので結果は workers=1 と完全に一致する。
+            parallel="process" にすると、場と係数を共有メモリに置き、スレッドの代わりに workers 個の
+            常駐プロセスでタイルを更新する（TileWorkers.py 参照。結果はやはり workers=1 と一致する）。
+            NumPy の演算は1回が短いとスレッドでは GIL の受け渡しで並列に進みにくいので、大きなグリッドではこちらを使う。
+            使い終わったら close() か with 文でプロセスを止め、共有メモリを解放する
+            （呼ばずにシミュレーターを破棄した場合も、その時点で解放される）。
+
+            backend は計算カーネルの選択（"numpy" / "numba" / "auto"）。
+            "numba" ではステンシル・減衰・最大値の記録を1回のループにまとめた JIT 版を使う。
+            numba がインストールされていない場合は NumPy 実装で計算する。
+
+            dtype=np.float32 にすると場・係数の配列を全て単精度で持ち、メモリ量と帯域を半分にする。
+            倍精度との差は precision_report() で確認できる。
+
+            engine="sparse" の場合、波を伝えるマス（active_mask、省略時は波速が有限のマス）だけで
+            変数係数のラプラシアンを scipy.sparse の CSR 行列として一度だけ組み立て、
+            毎ステップはそのマスだけを取り出して疎行列×ベクトルで更新する。
+            それ以外のマスは常に0の壁として扱う。対象のマスがごく一部（1〜2割以下）のステージで計算量が減る。
+            （このモードでは active_window / workers / backend は使わない。メンバー毎の波速にも対応しない）
+            engine="dense" で active_mask を指定した場合は、対象外のマスの係数を0にして同じ壁として扱う
+            （全域を計算するが、対象のマスが多ければ疎行列より速い）。
+
+            order=4 にすると空間4次精度の13点ステンシル（各軸2マス先まで）を使う。
+            数値分散が小さいので、粗いグリッドでも2次精度の細かいグリッドと同程度の u_max が得られる
+            （StencilConvergence.py 参照）。外周の壁はステンシルに合わせて2マスになる。
+
+            stations に観測点のマス (x, y) のリストを渡すと、station_stride ステップ毎にその点の変位を記録する
+            （仮想の地震計・潮位計）。記録先は計算開始時に (観測点数, 記録回数) で確保し、
+            毎回は観測点の値だけを取り出して書き込むので、フレームを保存するより負荷が小さい。
+            記録した波形は run() の戻り値、または traces で受け取る。
+
+            track_timing=True にすると、各マスについて u_max が最後に更新されたステップ（最大振幅の時刻）と、
+            振幅が初めて arrival_threshold を超えたステップ（波の到達時刻）を計算しながら記録する。
+            結果は timing_maps() で受け取る（まだ到達していないマスは -1）。
+
+            save_frames=True の場合、フレームの描画・保存は計算と並行して別スレッドで行う。
+            frame_processes > 0 にするとその数のプロセスで並列に描画する（描画が計算より重い場合）。
+        """
+        self.grid_shape = grid_shape
+        self.nx, self.ny = grid_shape
+        self.dx = dx
+        self.mu = mu
+        self.save_frames = save_frames
+        self.frame_processes = frame_processes
+        self.active_window = active_window
+        self.absorbing_width = absorbing_width
+        self.workers = workers
+        if parallel not in ("thread", "process"):
+            raise ValueError(f"parallel は \"thread\" か \"process\" を指定してください。指定値: {parallel}")
+        self.parallel = parallel
+        self._executor = None
+        self._tile_pool = None
+        self.backend = WaveKernels.resolve_backend(backend)
+        self.dtype = np.dtype(dtype)
+        if engine not in ("dense", "sparse"):
+            raise ValueError(f"engine は \"dense\" か \"sparse\" を指定してください。指定値: {engine}")
+        self.engine = engine
+
+        # ステンシルの幅（2次: 1マス、4次: 2マス）の壁＋吸収層の分だけ拡張する
+        if order not in (2, 4):
+            raise ValueError(f"order は 2 か 4 を指定してください。指定値: {order}")
+        self.order = order
+        self.halo = order // 2
+        self.pad = self.halo + absorbing_width
+        self.interior = (Ellipsis, slice(self.pad, self.pad + self.nx), slice(self.pad, self.pad + self.ny))
+
+        # 発生源が複数、または媒質マップがメンバー毎ならアンサンブル軸を先頭に持たせる
+        sources = np.asarray(sources, dtype=int)
+        medium_map = np.asarray(medium_map, dtype=self.dtype)
+        self.batched = sources.ndim == 2 or medium_map.ndim == 3
+        if self.batched:
+            self.n_members = len(sources) if sources.ndim == 2 else len(medium_map)
+            if medium_map.ndim == 3 and len(medium_map) != self.n_members:
+                raise ValueError(f"媒質マップのメンバー数が発生源の数と一致しません。発生源: {self.n_members}\n媒質マップ: {medium_map.shape}")
+            sources = np.broadcast_to(sources.reshape(-1, 2), (self.n_members, 2))
+            amplitudes = np.broadcast_to(np.asarray(amplitudes, dtype=float), (self.n_members,))
+        else:
+            self.n_members = 1
+        if medium_map.ndim == 3 and self.engine == "sparse":
+            raise ValueError("engine=\"sparse\" はメンバー毎に異なる媒質マップには対応していません。")
+
+        # 拡張した形状
+        padded_shape = (self.nx + 2 * self.pad, self.ny + 2 * self.pad)
+        field_shape = (self.n_members,) + padded_shape if self.batched else padded_shape
+
+        # 3本のバッファを使い回す（u_prev → u_curr → u_next をローテーション）
+        self.u_prev = np.zeros(field_shape, dtype=self.dtype)
+        self.u_curr = np.zeros(field_shape, dtype=self.dtype)
+        self.u_next = np.zeros(field_shape, dtype=self.dtype)
+        self.u_max = np.zeros(field_shape, dtype=self.dtype)
+
+        # 作業用バッファ（ステップ毎の一時配列を確保しないため）
+        self._lap = np.zeros(field_shape, dtype=self.dtype)
+        self._views = {}  # 計算範囲のビューの使い回し（_region_views() 参照）
+        self._eigenvalue = None  # 振幅の上限に使う固有値（_min_eigenvalue() 参照）
+        self._bound_cache = None  # 振幅の上限に使う 1/k と係数（_bound_terms() 参照）
+        self._bound = None  # 最後に求めた振幅の上限（吸収層がなければ使い回す）
+
+        # 媒質マップも同じだけ拡張（メンバー軸は拡張しない）
+        pad_width = ((0, 0),) * (medium_map.ndim - 2) + ((self.pad, self.pad),) * 2
+        self.medium = np.pad(medium_map, pad_width=pad_width, mode='edge')
+
+        # 波速 c = sqrt(mu / medium) の範囲（CFL 条件の確認と dt の自動決定に使う）
+        c2 = self.mu / self.medium
+        self._set_wave_speed(c2)
+        self.dt = self._resolve_dt(dt, cfl)
+
+        # c² * dt² / dx² は時間変化しないので一度だけ計算する（c² の配列をそのまま使い、一時配列を作らない）
+        c2 *= (self.dt / self.dx) ** 2
+        self.coef = c2.astype(self.dtype, copy=False)
+        # NumPy 版は行全体を1次元の連続した範囲として更新するので、左右の壁の列は係数を0にして常に0のままにする
+        self.coef[..., :self.halo] = 0
+        self.coef[..., -self.halo:] = 0
+
+        # 発生源の位置をずらす（パディングを考慮）
+        if self.batched:
+            members = np.arange(self.n_members)
+            self.u_curr[members, sources[:, 0] + self.pad, sources[:, 1] + self.pad] = amplitudes
+        else:
+            x0, y0 = sources
+            self.u_curr[x0 + self.pad, y0 + self.pad] = amplitudes
+
+        # ラプラシアンに掛ける係数（4次精度のステンシルの 1/12 も含める）
+        self._stencil_coef = self.coef if self.order == 2 else (self.coef / 12).astype(self.dtype)
+        # 中心のマスの係数 2 - 4·c²dt²/dx²（4次精度は 2 - 60/12·c²dt²/dx²。壁の列は0）
+        # （u_next = 中心の係数 × u + c²dt²/dx² × 隣のマスの和 - u_prev として、-4u の項を別に計算しない）
+        self._center = np.multiply(self._stencil_coef, -4 if self.order == 2 else -60, dtype=self.dtype)
+        self._center += 2
+        self._center[..., :self.halo] = 0
+        self._center[..., -self.halo:] = 0
+
+        # 波を伝えないマス（active_mask の外）は係数を0にして、常に0の壁にする（u_next = 0·u + 0 - u_prev = 0）
+        if active_mask is not None and self.engine == "dense":
+            outside = ~self._padded_mask(active_mask)
+            for coefficients in (self.coef, self._stencil_coef, self._center):
+                coefficients[..., outside] = 0
+            self._discard_outside(outside)
+
+        # 減衰マスク
+        self.damping = self._create_damping_mask(padded_shape, damping_width).astype(self.dtype)
+        # 全て1（damping_width=1 など）なら掛け算を省く
+        self._damped = bool(np.any(self.damping != 1))
+
+        # 吸収層の係数: u_next = a * (2u + c²dt²/dx² * lap) - b * u_prev（吸収層なしなら持たない）
+        self.sponge_a = self.sponge_b = None
+        if absorbing_width > 0:
+            self.sponge_a, self.sponge_b = self._create_absorbing_layer(padded_shape, absorbing_width, absorbing_strength)
+
+        # 疎行列モードの演算子（波を伝えるマスだけ）
+        if self.engine == "sparse":
+            self._build_sparse_operator(active_mask)
+
+        # 計算範囲（u_prev / u_curr が非ゼロになりうる矩形）
+        self._window = self._nonzero_bounds()
+
+        # 計算済みのステップ数と、早期終了した場合の終了ステップ
+        self.step_count = 0
+        self.stopped_step = None
+
+        # 観測点（パディング込みの座標）と記録した波形
+        self._set_stations(stations, station_stride)
+        self.traces = None
+
+        # 到達時刻・最大振幅の時刻（ステップ数、未到達は -1）
+        self.track_timing = track_timing
+        self.arrival_threshold = arrival_threshold
+        if track_timing:
+            self.arrival_step = np.full(self.u_curr.shape, -1, dtype=np.int32)
+            self.peak_step = np.full(self.u_curr.shape, -1, dtype=np.int32)
+
+    @classmethod
+    def precision_report(cls, steps=200, thresholds=None, dtype=np.float32, **kwargs):
+        """
+            同じ条件で dtype と倍精度の計算を行い、u_max の最大相対誤差と倒壊判定が変わったマス数を返す
+            （kwargs はコンストラクタの引数。PrecisionCheck.compare_precision() 参照）
+        """
+        return PrecisionCheck.compare_precision(cls, steps=steps, thresholds=thresholds, dtype=dtype, **kwargs)
+
+    def _set_wave_speed(self, c2):
+        """波速の2乗 c² の配列から最大・最小波速を求める"""
+        self.c_max = np.sqrt(np.max(c2))
+        self.c_min = np.sqrt(np.min(c2))
+
+    def max_stable_dt(self):
+        """
+            CFL 条件を満たす最大の dt
+            （2次元で2次精度: c_max·dt/dx <= 1/√2、4次精度: c_max·dt/dx <= √(3/8)）
+        """
+        limit = 1 / np.sqrt(2) if self.order == 2 else np.sqrt(3 / 8)
+        return limit * self.dx / self.c_max
+
+    def _resolve_dt(self, dt, cfl):
+        """dt="auto" なら CFL 条件から dt を決め、数値なら安定性を確認してそのまま返す"""
+        if dt == "auto":
+            if not np.isfinite(self.c_max) or self.c_max <= 0:
+                raise ValueError(f"波速が有限の正の値ではないため dt を自動決定できません。c_max: {self.c_max}")
+            return cfl * self.max_stable_dt()
+        if dt > self.max_stable_dt():
+            print(f"※dt={dt} は CFL 条件を満たしていません（安定な dt の上限: {self.max_stable_dt():.4g}）。計算が発散する可能性があります。")
+        return dt
+
+    def steps_for(self, duration=None, reach=None):
+        """
+            物理時間 duration、または波を届かせたい距離 reach（マス数）からステップ数を決める。
+            reach は最も遅い波速でも届くステップ数にする。
+        """
+        if duration is None and reach is None:
+            raise ValueError("duration か reach のどちらかを指定してください。")
+        if duration is None:
+            duration = reach * self.dx / self.c_min
+        return int(np.ceil(duration / self.dt))
+
+    def _padded_mask(self, active_mask):
+        """マップの大きさの active_mask をパディング込みに広げる（マップ外の吸収層は端のマスと同じ扱い、外周の壁は False）"""
+        mask = np.pad(np.asarray(active_mask, dtype=bool), pad_width=self.pad - self.halo, mode='edge')
+        return np.pad(mask, pad_width=self.halo, mode='constant', constant_values=False)
+
+    def _discard_outside(self, outside):
+        """対象外のマスにある初期値は捨てる（壁なので波を出さない）"""
+        if np.any(self.u_curr[..., outside] != 0):
+            print("※波を伝えないマスにある初期値は無視します。")
+            self.u_curr[..., outside] = 0
+
+    def _build_sparse_operator(self, active_mask):
+        """
+            波を伝えるマスだけを対象に、c²dt²/dx² × ラプラシアンの CSR 行列を組み立てる。
+            対象外の隣接マスは値0の壁として扱う（行列に含めない）。
+        """
+        from scipy import sparse
+
+        if active_mask is None:
+            active_mask = np.isfinite(self.coef[self.interior])
+        mask = self._padded_mask(active_mask)
+        self._discard_outside(~mask)
+
+        # パディング込みのグリッドを1次元に並べたときの番号 → 対象マスの通し番号
+        self._active = np.flatnonzero(mask)
+        n = len(self._active)
+        compact = np.full(mask.size, -1)
+        compact[self._active] = np.arange(n)
+
+        coef = self._stencil_coef.ravel()[self._active]
+        width = mask.shape[1]
+        if self.order == 2:
+            center, neighbors = -4, [(-width, 1), (width, 1), (-1, 1), (1, 1)]
+        else:
+            center = -60
+            neighbors = [(-width, 16), (width, 16), (-1, 16), (1, 16), (-2 * width, -1), (2 * width, -1), (-2, -1), (2, -1)]
+        rows = [np.arange(n)]
+        cols = [np.arange(n)]
+        data = [center * coef]
+        for offset, weight in neighbors:
+            neighbor = compact[self._active + offset]
+            connected = neighbor >= 0
+            rows.append(np.flatnonzero(connected))
+            cols.append(neighbor[connected])
+            data.append(weight * coef[connected])
+        self._operator = sparse.csr_matrix(
+            (np.concatenate(data), (np.concatenate(rows), np.concatenate(cols))), shape=(n, n), dtype=self.dtype
+        )
+
+        # 対象マスだけ取り出した係数
+        self._active_damping = self.damping.ravel()[self._active]
+        if self.absorbing_width > 0:
+            self._active_sponge_a = self.sponge_a.ravel()[self._active]
+            self._active_sponge_b = self.sponge_b.ravel()[self._active]
+
+    def _update_sparse(self):
+        """対象マスの値を取り出し、疎行列×ベクトルで u_next と u_max を更新する"""
+        # アンサンブル実行時も (マス数, メンバー数) の形にして1回の積で計算する
+        flat = (-1, self.u_curr.shape[-2] * self.u_curr.shape[-1])
+        u = self.u_curr.reshape(flat)[:, self._active].T
+        u_prev = self.u_prev.reshape(flat)[:, self._active].T
+        damping = self._active_damping[:, None]
+
+        lap = self._operator @ u
+        if self.absorbing_width > 0:
+            u_next = (2 * u + lap) * self._active_sponge_a[:, None] - self._active_sponge_b[:, None] * u_prev
+        else:
+            u_next = 2 * u - u_prev + lap
+        u_next *= damping
+
+        self.u_next.reshape(flat)[:, self._active] = u_next.T
+        u_max = self.u_max.reshape(flat)
+        u_max[:, self._active] = np.maximum(u_max[:, self._active], np.abs(u_next.T))
+
+    def set_field(self, u_curr, u_prev=None):
+        """
+            マップ範囲の初期場を直接設定する（点震源以外の初期条件用）。
+            u_prev を省略すると u_curr と同じ値（初速度0）にする。
+        """
+        self.u_curr[self.interior] = u_curr
+        self.u_prev[self.interior] = u_curr if u_prev is None else u_prev
+        self._window = self._nonzero_bounds()
+
+    def _nonzero_bounds(self):
+        """u_prev / u_curr の非ゼロ領域の外接矩形 (i0, i1, j0, j1) を返す（全て0なら None）"""
+        nonzero = (self.u_curr != 0) | (self.u_prev != 0)
+        nonzero = nonzero.reshape((-1,) + nonzero.shape[-2:]).any(axis=0)
+        rows = np.flatnonzero(nonzero.any(axis=1))
+        cols = np.flatnonzero(nonzero.any(axis=0))
+        if len(rows) == 0:
+            return None
+        return (rows[0], rows[-1] + 1, cols[0], cols[-1] + 1)
+
+    def _advance_window(self):
+        """今回のステップで計算する範囲を返し、計算範囲をステンシルの幅だけ広げる"""
+        h = self.halo
+        i_end = self.nx + 2 * self.pad - h
+        j_end = self.ny + 2 * self.pad - h
+        if not self.active_window:
+            return (h, i_end, h, j_end)
+        if self._window is None:
+            return None
+        i0, i1, j0, j1 = self._window
+        self._window = (max(i0 - h, h), min(i1 + h, i_end), max(j0 - h, h), min(j1 + h, j_end))
+        return self._window
+
+    def _create_absorbing_layer(self, shape, width, strength):
+        """
+            吸収層の係数 (a, b) を返す。減衰項 γ·u_t を加えた波動方程式を中心差分で離散化すると
+            u_next = (2u - (1 - g) u_prev + c²dt²/dx² lap) / (1 + g)  （g = γ·dt/2）
+            となるので、a = 1 / (1 + g), b = (1 - g) / (1 + g) を事前計算しておく。
+            吸収層の外では g = 0（a = b = 1）。
+            γ は最大波速で吸収層を横切る時間に合わせて決めるので、dt や波速を変えても吸収の効き方が変わらない。
+        """
+        nx, ny = shape
+        # 各マスがマップ端から吸収層に何マス入り込んでいるか（マップ内は0）
+        inner_x = np.arange(nx)
+        inner_y = np.arange(ny)
+        depth_x = np.maximum(np.maximum(self.pad - inner_x, inner_x - (nx - 1 - self.pad)), 0)
+        depth_y = np.maximum(np.maximum(self.pad - inner_y, inner_y - (ny - 1 - self.pad)), 0)
+        depth = np.maximum(depth_x[:, None], depth_y[None, :])
+
+        g = np.zeros(shape)
+        if width > 0:
+            # c_max·dt/dx = sqrt(max(c²dt²/dx²))（メンバー毎の波速なら、メンバー毎に (N, 1, 1) で求める）
+            finite = np.where(np.isfinite(self.coef), self.coef, 0)
+            courant = np.sqrt(finite.max(axis=(-2, -1), keepdims=True))
+            g_max = np.minimum(strength * courant / (2 * width), 1.0)
+            g = g_max * (np.minimum(depth, width) / width) ** 2
+        a = 1.0 / (1.0 + g)
+        b = (1.0 - g) / (1.0 + g)
+        return a.astype(self.dtype), b.astype(self.dtype)
+
+    def _create_damping_mask(self, shape, width):
+        nx, ny = shape
+        damping = np.ones(shape)
+        for i in range(width):
+            factor = (1 - i / width) ** 2
+            damping[i, :] *= factor
+            damping[-i - 1, :] *= factor
+            damping[:, i] *= factor
+            damping[:, -i - 1] *= factor
+        return damping
+
+    def laplacian(self, u):
+        """パディング込みの場 u のラプラシアン（order に合わせたステンシル、外周の壁は0）"""
+        h = self.halo
+        lap = np.zeros_like(u)
+
+        def shifted(di, dj):
+            return u[..., h + di:u.shape[-2] - h + di, h + dj:u.shape[-1] - h + dj]
+
+        if self.order == 2:
+            lap[..., h:-h, h:-h] = (
+                -4 * shifted(0, 0)
+                + shifted(-1, 0) + shifted(1, 0) + shifted(0, -1) + shifted(0, 1)
+            ) / (self.dx ** 2)
+        else:
+            lap[..., h:-h, h:-h] = (
+                -60 * shifted(0, 0)
+                + 16 * (shifted(-1, 0) + shifted(1, 0) + shifted(0, -1) + shifted(0, 1))
+                - (shifted(-2, 0) + shifted(2, 0) + shifted(0, -2) + shifted(0, 2))
+            ) / (12 * self.dx ** 2)
+        return lap
+
+    def step(self):
+        """
+            1ステップ進める。
+            事前確保したバッファに out= で書き込み、ステップ中に全グリッドの一時配列を確保しない。
+            外周の壁は常に0のままなので内部領域（active_window 時は波の届いた範囲）だけを更新する。
+            アンサンブル実行時は先頭軸をそのまま放送して全メンバーを一度に更新する。
+        """
+        region = self._advance_window()
+        if self.engine == "sparse":
+            self._update_sparse()
+        elif region is not None:
+            if self.workers > 1:
+                self._update_tiled(*region)
+            else:
+                self._update_region(*region)
+        if self.track_timing and region is not None:
+            self._update_timing(*region)
+
+        # バッファのローテーション（古い u_prev を次の書き込み先に使う）
+        self.u_prev, self.u_curr, self.u_next = self.u_curr, self.u_next, self.u_prev
+        self.step_count += 1
+        if self.traces is not None and (self.step_count - self._trace_origin) % self.station_stride == 0:
+            self._record_stations()
+
+    def outcome_decided(self, thresholds):
+        """
+            残りのステップで倒壊判定が変わりうる建物がもう残っていないかを返す。
+
+            まだ閾値を超えていないマスについて、今後の振幅の上限（_amplitude_bound()、離散エネルギーから求めた
+            厳密な上限）が全ての閾値以下なら、以降のステップでそのマスが閾値を超えることはない。
+            上限を求められない場合（減衰マスクあり、dt が CFL 条件ぎりぎり）は常に False。
+
+            上限は場全体のエネルギーから求めるので緩く（実際の振幅の十数倍）、吸収層がなければエネルギーは減らないので、
+            閾値が上限より低い建物が1つでも残っていれば最後まで終了しない。吸収層で波が抜けた後の打ち切りに向く。
+
+            Parameters:
+                thresholds (ndarray): (nx, ny) の倒壊閾値。建物のないマスは np.inf（collapse_thresholds() 参照）
+        """
+        undecided = self.u_max[self.interior] <= thresholds
+        if not undecided.any():
+            return True
+        bound = self._amplitude_bound()
+        if bound is None:
+            return False
+        # メンバー毎の上限を (メンバー数, 1, 1) にして各マスの閾値と比べる
+        bound = np.reshape(bound, np.shape(bound) + (1, 1))
+        thresholds = np.broadcast_to(thresholds, undecided.shape)
+        return bool(np.all(bound <= thresholds, where=undecided))
+
+    def _amplitude_bound(self):
+        """
+            これから先の全てのステップでの |u| の上限をメンバー毎に返す（求められない場合は None）。
+
+            k をラプラシアンの係数（_stencil_coef）、D を整数係数のステンシルの符号を変えた行列
+            （2次精度: 中心 4・隣 -1、4次精度: 中心 60・隣 -16・2マス先 1。外周の壁は0）とすると、
+            リープフロッグ法では E = Σ (u_curr - u_prev)² / k + u_currᵀ D u_prev がステップ毎に保存される
+            （吸収層があれば減る）。δ = u_curr - u_prev、s = u_curr + u_prev と書くと
+            E = δᵀ(1/k - D/4)δ + sᵀDs/4 で、CFL 条件を満たせば
+            ‖δ‖² ≤ E / m（m = 1/max(k) - D の行の絶対値和/4 > 0）、‖s‖² ≤ 4E / λ（λ は D の最小固有値）なので、
+            どのマスでも |u| ≤ ‖u‖ ≤ (‖s‖ + ‖δ‖) / 2 ≤ √E (1/√λ + 1/(2√m))。
+            減衰マスク（damping_width > 1）はこの E を増やしうるので、その場合は上限を求めない。
+
+            吸収層がなければ E は変わらないので、一度求めた上限を使い回す。
+            E は作業用バッファ（_lap）と配列の積の和（einsum）で求め、全グリッドの一時配列を確保しない。
+        """
+        if self._bound is not None and self.absorbing_width == 0:
+            return self._bound
+        terms = self._bound_terms()
+        if terms is None:
+            return None
+        inverse_k, factor = terms
+
+        # 運動エネルギーの項 Σ δ² / k（壁・対象外のマスは 1/k を0にしている）
+        delta = np.subtract(self.u_curr, self.u_prev, out=self._lap)
+        energy = np.einsum("...ij,...ij,...ij->...", delta, delta, inverse_k)
+
+        # u_currᵀ D u_prev = 中心の係数 × Σ u_curr u_prev - Σ（隣の重み × Σ u_curr(x) u_prev(x + ずれ)）
+        h = self.halo
+        height, width = self.u_curr.shape[-2:]
+        inner = self.u_curr[..., h:height - h, h:width - h]
+
+        def shifted(di, dj):
+            return self.u_prev[..., h + di:height - h + di, h + dj:width - h + dj]
+
+        if self.order == 2:
+            stencil = ((4, ((0, 0),)), (-1, ((-1, 0), (1, 0), (0, -1), (0, 1))))
+        else:
+            stencil = (
+                (60, ((0, 0),)),
+                (-16, ((-1, 0), (1, 0), (0, -1), (0, 1))),
+                (1, ((-2, 0), (2, 0), (0, -2), (0, 2))),
+            )
+        for weight, offsets in stencil:
+            for di, dj in offsets:
+                energy = energy + weight * np.einsum("...ij,...ij->...", inner, shifted(di, dj))
+
+        # 丸め誤差の分の余裕
+        self._bound = np.sqrt(np.maximum(energy, 0)) * factor * 1.001
+        return self._bound
+
+    def _bound_terms(self):
+        """
+            _amplitude_bound() で使う 1/k の配列と √E に掛ける係数を返す（初回のみ計算。上限を求められない場合は None）
+        """
+        if self._damped:
+            return None
+        if self._bound_cache is None:
+            k = self._stencil_coef
+            row_sum = 8 if self.order == 2 else 128
+            with np.errstate(divide="ignore"):
+                m = 1 / k.max(axis=(-2, -1)) - row_sum / 4
+            if not np.all(m > 0):
+                self._bound_cache = ()
+            else:
+                inverse_k = np.zeros(k.shape, dtype=np.float64)
+                np.divide(1, k, out=inverse_k, where=k > 0)
+                factor = 1 / np.sqrt(self._min_eigenvalue()) + 1 / (2 * np.sqrt(m))
+                self._bound_cache = (inverse_k, factor)
+        return self._bound_cache or None
+
+    def _min_eigenvalue(self):
+        """
+            _amplitude_bound() の D の最小固有値（初回のみ計算）。
+            D は x 方向と y 方向の1次元のステンシルの和なので、それぞれの帯行列の最小固有値の和になる。
+            疎行列モードの対象マスだけの D はこの部分行列なので、最小固有値はこれ以上になる。
+        """
+        if self._eigenvalue is None:
+            from scipy.linalg import eigvals_banded
+
+            band = (2, -1) if self.order == 2 else (30, -16, 1)
+            self._eigenvalue = 0.0
+            for n in self.u_curr.shape[-2:]:
+                n -= 2 * self.halo
+                matrix = np.zeros((len(band), n))
+                for offset, weight in enumerate(band):
+                    matrix[offset, :n - offset] = weight
+                self._eigenvalue += eigvals_banded(matrix, lower=True, select="i", select_range=(0, 0))[0]
+        return self._eigenvalue
+
+    def _update_tiled(self, i0, i1, j0, j1, min_rows=32):
+        """計算範囲を行方向に分割し、スレッドプール（parallel="process" ならプロセス）で並列に _update_region() を実行する"""
+        n_tiles = min(self.workers, max((i1 - i0) // min_rows, 1))
+        if n_tiles == 1:
+            self._update_region(i0, i1, j0, j1)
+            return
+        if self.parallel == "process":
+            # fork() した複製などでバッファが共有メモリでなくなっていたら、共有メモリに移し直す
+            if self._tile_pool is not None and not self._tile_pool.owns(self):
+                self._tile_pool.shutdown(self)
+                self._tile_pool = None
+            if self._tile_pool is None:
+                self._tile_pool = TileWorkers.SharedTilePool(self, self.workers)
+            self._tile_pool.update(self, np.linspace(i0, i1, n_tiles + 1).astype(int), j0, j1)
+            return
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.workers)
+        # NumPy の演算中は GIL が解放されるので、タイル毎の更新は並列に進む
+        edges = np.linspace(i0, i1, n_tiles + 1).astype(int)
+        futures = [
+            self._executor.submit(self._update_region, a, b, j0, j1)
+            for a, b in zip(edges[:-1], edges[1:])
+        ]
+        # 全タイルの更新が終わるまで待つ（ここがステップ間の同期点）
+        for future in futures:
+            future.result()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        """並列計算用のスレッドプール・ワーカープロセスを終了する（共有メモリの場は通常のメモリに戻す）"""
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+        if self._tile_pool is not None:
+            self._tile_pool.shutdown(self)
+            self._tile_pool = None
+
+    # ステップ毎に書き換わる配列（fork() で複製するもの）
+    _STATE_ARRAYS = ("u_prev", "u_curr", "u_next", "u_max", "_lap", "traces", "arrival_step", "peak_step")
+
+    def save_state(self, path):
+        """
+            途中経過（場・最大値・係数・ステップ数）を .npz に保存する。
+            同じ条件で作ったシミュレーターの load_state() で続きから計算できる。
+            観測点の波形は保存しない（再開後の run() で新しく記録する）。
+        """
+        state = {
+            "u_prev": self.u_prev,
+            "u_curr": self.u_curr,
+            "u_max": self.u_max,
+            "coef": self.coef,
+            "step_count": self.step_count,
+            "window": np.asarray(self._window if self._window is not None else (), dtype=int),
+        }
+        if self.track_timing:
+            state["arrival_step"] = self.arrival_step
+            state["peak_step"] = self.peak_step
+        np.savez(path, **state)
+
+    def load_state(self, path):
+        """
+            save_state() で保存した途中経過を読み込む。
+            場の形状（グリッド・吸収層・アンサンブル数）と dtype は保存時と同じである必要がある。
+            係数が保存時と異なる場合は、現在の係数で計算を続ける（条件を変えた分岐用）。
+        """
+        with np.load(path) as state:
+            if state["u_curr"].shape != self.u_curr.shape or state["u_curr"].dtype != self.dtype:
+                raise ValueError(
+                    f"保存した場の形状・型が一致しません。期待: {self.u_curr.shape} {self.dtype}\n実際: {state['u_curr'].shape} {state['u_curr'].dtype}"
+                )
+            if not np.array_equal(state["coef"], self.coef):
+                print("※保存時と係数が異なります。現在の係数で計算を続けます。")
+            np.copyto(self.u_prev, state["u_prev"])
+            np.copyto(self.u_curr, state["u_curr"])
+            np.copyto(self.u_max, state["u_max"])
+            self.u_next.fill(0)
+            self.step_count = int(state["step_count"])
+            self._bound = None
+            window = state["window"]
+            self._window = tuple(int(v) for v in window) if len(window) else None
+            if self.track_timing:
+                if "arrival_step" in state:
+                    np.copyto(self.arrival_step, state["arrival_step"])
+                    np.copyto(self.peak_step, state["peak_step"])
+                else:
+                    print("※保存した途中経過に到達時刻がないため、到達時刻は読み込み後から記録します。")
+        self.stopped_step = None
+
+    def fork(self):
+        """
+            現在の状態を複製した新しいシミュレーターを返す。
+            共通の前半を1回だけ計算し、そこから条件を変えた続きを複数計算するときに使う。
+            係数などの変化しない配列は共有し、場などステップ毎に書き換わる配列だけをコピーする。
+        """
+        clone = copy.copy(self)
+        for name in self._STATE_ARRAYS:
+            value = getattr(self, name, None)
+            if value is not None:
+                setattr(clone, name, value.copy())
+        # スレッドプール・ワーカープロセスは共有しない（必要になったときに作り直す）
+        clone._executor = None
+        clone._tile_pool = None
+        clone._views = {}
+        return clone
+
+    def _update_region(self, i0, i1, j0, j1):
+        """i0〜i1 行（パディング込みの座標）の u_next と u_max を更新する（NumPy 版は行全体を更新する。_region_views() 参照）"""
+        if self.backend == "numba":
+            # カーネルは (メンバー数, nx, ny) の配列を受け取るので、2次元の場合は先頭に軸を足す
+            # （係数・吸収層はメンバー共通なら (1, nx, ny)。吸収層なしなら使われないので係数の配列を代わりに渡す）
+            shape = (-1,) + self.u_curr.shape[-2:]
+            coef = self._stencil_coef.reshape(shape)
+            absorbing = self.sponge_a is not None
+            WaveKernels.fused_step(
+                self.u_prev.reshape(shape), self.u_curr.reshape(shape),
+                self.u_next.reshape(shape), self.u_max.reshape(shape),
+                coef, self._center.reshape(shape), self.damping,
+                self.sponge_a.reshape(shape) if absorbing else coef,
+                self.sponge_b.reshape(shape) if absorbing else coef,
+                absorbing, self._damped, self.order, i0, i1, j0, j1,
+            )
+            return
+
+        u, neighbors, far, u_prev, nxt, lap, u_max, coef, center, sponge_a, sponge_b, damping = self._region_views(i0, i1, j0, j1)
+
+        # 隣の4マスの和（中心の -4u は _center に含めている。dx² は coef に含めている）
+        np.add(neighbors[0], neighbors[1], out=lap)
+        lap += neighbors[2]
+        lap += neighbors[3]
+        if self.order == 4:
+            # 4次精度: 16 × 隣の4マス - 2マス先の4マス（-60u と 1/12 は _center / _stencil_coef に含めている）
+            lap *= 16
+            for view in far:
+                lap -= view
+        lap *= coef
+
+        # u_next = (2 - 4c²dt²/dx²) u + c²dt²/dx² × 隣の和 - u_prev
+        np.multiply(center, u, out=nxt)
+        nxt += lap
+        if self.absorbing_width > 0:
+            # 吸収層あり: u_next = a * (2u + c²dt²/dx² * lap) - b * u_prev（lap は作業用に使い回す）
+            nxt *= sponge_a
+            np.multiply(sponge_b, u_prev, out=lap)
+            nxt -= lap
+        else:
+            nxt -= u_prev
+        if self._damped:
+            nxt *= damping
+
+        # 最大振幅の記録
+        np.abs(nxt, out=lap)
+        np.maximum(u_max, lap, out=u_max)
+
+    def _region_views(self, i0, i1, j0, j1):
+        """
+            _update_region() で使う i0〜i1 行のビューをまとめて返す。
+
+            行の全体（左右の壁を含む）を1次元の連続した範囲として扱い、隣のマスは ±1（左右）・±行の長さ（上下）
+            ずらした範囲として取り出す。2次元の部分配列より連続した配列の演算の方が数倍速い。
+            壁の列は係数が0なので、行の端で隣の行に回り込んだ値を読んでも結果は0のまま。
+            範囲外の列（j0, j1 の外）も計算するが、場が0のマスは0のままなので結果は変わらない。
+
+            計算範囲は波が広がりきると変わらず、バッファも3本を回すだけなので、ビューは作り直さずに使い回す。
+        """
+        key = (i0, i1, id(self.u_prev), id(self.u_curr), id(self.u_next))
+        views = self._views.get(key)
+        if views is not None:
+            return views
+        if len(self._views) > 64:
+            self._views.clear()
+        width = self.u_curr.shape[-1]
+        a, b = i0 * width, i1 * width
+
+        def rows(field, offset=0):
+            return field.reshape(field.shape[:-2] + (-1,))[..., a + offset:b + offset]
+
+        u = self.u_curr
+        neighbors = tuple(rows(u, offset) for offset in (-width, width, -1, 1))
+        far = tuple(rows(u, offset) for offset in (-2 * width, 2 * width, -2, 2)) if self.order == 4 else ()
+        views = (
+            rows(u), neighbors, far, rows(self.u_prev), rows(self.u_next), rows(self._lap), rows(self.u_max),
+            rows(self._stencil_coef), rows(self._center),
+            rows(self.sponge_a) if self.sponge_a is not None else None,
+            rows(self.sponge_b) if self.sponge_b is not None else None,
+            rows(self.damping),
+        )
+        self._views[key] = views
+        return views
+
+    def save_frame(self, step, output_dir="frames", member=0):
+        """内部領域だけを描画・保存（アンサンブル実行時は member 番目を描画）"""
+        os.makedirs(output_dir, exist_ok=True)
+        self._frame_renderer(output_dir)(step, self._frame_field(member))
+
+    def _frame_field(self, member=0):
+        """描画する場（マップ範囲、アンサンブル実行時は member 番目）"""
+        trimmed_u = self.u_curr[self.interior]
+        if self.batched:
+            trimmed_u = trimmed_u[member]
+        return trimmed_u
+
+    def _frame_renderer(self, output_dir):
+        """render(step, field) でフレームを1枚保存する関数（pickle できるので描画用のプロセスにも渡せる）"""
+        return functools.partial(FrameWriter.write_frame, output_dir=output_dir, **self.FRAME_STYLE)
+
+    def _video_writer(self, video_path, fps):
+        """場を直接動画にエンコードする書き出し先（色はフレーム画像と同じ）"""
+        return FrameWriter.VideoFrameWriter(
+            video_path, fps=fps, cmap=self.FRAME_STYLE["cmap"], symmetric=self.FRAME_STYLE["symmetric"]
+        )
+
+    def _set_stations(self, stations, stride):
+        """観測点の座標を確認し、u_curr から値を取り出すためのインデックスを作る"""
+        if stride < 1:
+            raise ValueError(f"station_stride は1以上を指定してください。指定値: {stride}")
+        self.station_stride = stride
+        if stations is None:
+            self.stations = None
+            return
+        self.stations = np.asarray(stations, dtype=int).reshape(-1, 2)
+        xs, ys = self.stations[:, 0], self.stations[:, 1]
+        if np.any((xs < 0) | (xs >= self.nx) | (ys < 0) | (ys >= self.ny)):
+            raise ValueError(f"観測点がマップの範囲外です。マップ: ({self.nx}, {self.ny})\n観測点: {self.stations.tolist()}")
+        self._station_index = (Ellipsis, xs + self.pad, ys + self.pad)
+
+    def _start_traces(self, steps):
+        """steps 分の計算で記録する波形の配列を確保する（観測点がなければ何もしない）"""
+        if self.stations is None:
+            return
+        n_records = steps // self.station_stride
+        # アンサンブル実行時は (メンバー数, 観測点数, 記録回数)
+        shape = self.u_curr.shape[:-2] + (len(self.stations), n_records)
+        self.traces = np.zeros(shape, dtype=self.dtype)
+        self._trace_origin = self.step_count
+        self._trace_count = 0
+
+    def _update_timing(self, i0, i1, j0, j1):
+        """今回のステップで u_max が更新されたマスと、初めて閾値を超えたマスにステップ数を書き込む"""
+        inner = (Ellipsis, slice(i0, i1), slice(j0, j1))
+        amplitude = np.abs(self.u_next[inner], out=self._lap[inner])
+        step = self.step_count + 1
+        # u_max は |u_next| との最大値なので、等しければ今回更新された（0 のままのマスは除く）
+        np.copyto(self.peak_step[inner], step, where=(amplitude == self.u_max[inner]) & (amplitude > 0))
+        np.copyto(self.arrival_step[inner], step, where=(amplitude > self.arrival_threshold) & (self.arrival_step[inner] < 0))
+
+    def timing_maps(self):
+        """
+            波の到達ステップと最大振幅のステップの配列を返す（track_timing=True の場合のみ）。
+            時刻にするには dt を掛ける。
+
+            Returns:
+                tuple: (arrival_step, peak_step) マップ範囲の (nx, ny)（アンサンブル実行時は (N, nx, ny)）。未到達のマスは -1
+        """
+        if not self.track_timing:
+            raise ValueError("timing_maps() を使うには track_timing=True を指定してください。")
+        return self.arrival_step[self.interior], self.peak_step[self.interior]
+
+    def _record_stations(self):
+        """観測点の現在の変位を波形の配列に書き込む"""
+        if self._trace_count < self.traces.shape[-1]:
+            self.traces[..., self._trace_count] = self.u_curr[self._station_index]
+            self._trace_count += 1
+
+    def iter_steps(self, steps=200, stride=1, duration=None, reach=None):
+        """
+            steps 分計算しながら、stride ステップ毎（と最後のステップ）に途中経過を返すジェネレーター。
+            描画・記録・打ち切り判定などを、シミュレーター側で知らなくても外から組み合わせられる。
+
+            返す配列は内部バッファの読み取り専用ビュー（コピーしない）。u_curr のバッファは
+            ローテーションで使い回すので、次の値を受け取った後まで残したい場合は呼び出し側でコピーする。
+            途中で break すればそこで計算を止められる。
+
+            Yields:
+                tuple: (計算済みのステップ数, 現在の場 u_curr, ここまでの最大値 u_max)
+                       いずれもマップ範囲だけ（アンサンブル実行時は (N, nx, ny)）
+        """
+        if duration is not None or reach is not None:
+            steps = self.steps_for(duration=duration, reach=reach)
+        if stride < 1:
+            raise ValueError(f"stride は1以上を指定してください。指定値: {stride}")
+        self._start_traces(steps)
+        for done in range(1, steps + 1):
+            self.step()
+            if done % stride == 0 or done == steps:
+                yield done, self._readonly(self.u_curr), self._readonly(self.u_max)
+
+    def _readonly(self, field):
+        """マップ範囲の読み取り専用ビューを返す"""
+        view = field[self.interior]
+        view.flags.writeable = False
+        return view
+
+    def run(
+        self, steps=200, save_interval=10, output_dir="frames", duration=None, reach=None,
+        thresholds=None, check_interval=10, video_path=None, fps=10,
+        recorder=None
+    ):
+        """
+            steps 分計算する（duration か reach を指定した場合は steps_for() でステップ数を決める）。
+
+            thresholds を指定すると check_interval ステップ毎に outcome_decided() を確認し、
+            残りのステップでどの建物の倒壊判定も変わりえないと示せれば途中で終了する。終了したステップ数は stopped_step に入る。
+            早期終了後の u_max は、閾値を超えていないマスでは最後まで計算した値より小さいことがある。
+
+            save_frames=True の場合、save_interval ステップ毎のフレームを AsyncFrameWriter で
+            計算と並行して output_dir に書き出し、run() は全てのフレームが保存されてから戻る。
+            video_path を指定すると、同じフレームを PNG を経由せずに直接動画（fps）にエンコードする。
+            recorder（ReplayRecorder）を渡すと、recorder.stride ステップ毎の場を量子化してメモリに記録する。
+
+            観測点（stations）を指定している場合は (u_max, traces) を返す。
+            traces[..., k] は (k+1)·station_stride ステップ目の各観測点の変位（早期終了時は記録した分だけ）。
+        """
+        if duration is not None or reach is not None:
+            steps = self.steps_for(duration=duration, reach=reach)
+        self.stopped_step = None
+        # フレームはコピーをキューに入れるだけにし、描画・保存は別スレッド（プロセス）で行う
+        writers = []
+        if self.save_frames:
+            os.makedirs(output_dir, exist_ok=True)
+            writers.append(FrameWriter.AsyncFrameWriter(self._frame_renderer(output_dir), processes=self.frame_processes))
+        video = None
+        if video_path is not None:
+            video = self._video_writer(video_path, fps)
+            # 動画はフレームの順番が大事なので1本のスレッドで書き出す
+            writers.append(FrameWriter.AsyncFrameWriter(video))
+        try:
+            for done, _, _ in self.iter_steps(steps):
+                step = done - 1
+                if writers and step % save_interval == 0:
+                    field = self._frame_field()
+                    for writer in writers:
+                        writer.submit(step, field)
+                if recorder is not None and step % recorder.stride == 0:
+                    recorder.record(step, self._frame_field())
+                if thresholds is not None and done % check_interval == 0 and done < steps:
+                    if self.outcome_decided(thresholds):
+                        self.stopped_step = done
+                        break
+        finally:
+            # 書き出し待ちのフレームが全て保存されるまで待つ
+            try:
+                for writer in writers:
+                    writer.close()
+            finally:
+                if video is not None:
+                    video.close()
+        # 内部領域だけ返す（アンサンブル実行時は (N, nx, ny)）
+        if self.stations is not None:
+            return self.u_max[self.interior], self.traces[..., :self._trace_count]
+        return self.u_max[self.interior]
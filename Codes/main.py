@@ -55,6 +55,7 @@ def main():
     ・シミュレーションの範囲をより広げて計算？
     ・シミュレーションの範囲を大きく広げ震源を真ん中に設定してシミュ->シミュ後に座標を移動？
     いずれにせよ、シミュレーションした範囲すべてを使うことはできないことに留意
+    → absorbing_width を指定するとマップの外側に吸収層を置くので、マップと同じ範囲のシミュレーションで済む
     """
 
     file_path = Path("../Config") / f"map_config.json"
@@ -90,7 +91,8 @@ def main():
             rho_map = weakness_map,
             # rho_map=np.ones((grid_width, grid_height)), #地盤密度を持つ配列​
             mu=10.0, #弾性係数​
-            dt=0.05
+            dt=0.05,
+            absorbing_width=8 #境界での反射を抑える吸収層の幅
         )
     max_disp = sim.run(steps=200) #揺れの大きの最大値を持つ配列​
 
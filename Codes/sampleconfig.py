@@ -8,12 +8,16 @@ import numpy as np
 import matplotlib.pyplot as plt
 
 from dataclasses import dataclass
+from concurrent.futures import ThreadPoolExecutor
 from DefineEpicenter_copy import DefineEpicenter
 import DefineMagnitude
 from DefineWeaknessMap import DefineWeaknessMap
 from EQSimulator import EQSimulatorVariableRho
+from ImpulseResponseLibrary import ImpulseResponseLibrary
+from ImpulseHistoryLibrary import ImpulseHistoryLibrary
 from DefinePermeabilityMap import DefinePermeabilityMap
 from TsunamiSimulator import TsunamiSimulatorVariableRho
+from WaterConnectivity import WaterConnectivity
 from LandslideSimulator import LandslideSimulator
 import PanelManager
 import result_inf
@@ -195,6 +199,12 @@ class SampleObject:
 
         self.field_switch = 0 # 震源地になる可能性のあるマスを表示する画面に切り替えるフラグ
 
+        self.impulse_libraries = {} # ステージ番号 → 地震の単位インパルス応答ライブラリ（準備中は Future）
+        self.library_builder = ThreadPoolExecutor(max_workers=1) # ライブラリをバックグラウンドで準備する
+        self.water_connectivities = {} # ステージ番号 → 水域の連結成分（津波の発生判定用）
+        self.history_libraries = {} # ステージ番号 → 地震の単位インパルス応答の時系列（断層破壊モード用）
+        self.rupture_mode = False # True なら震源を1点ではなく断層に沿って広がる破壊として扱う
+
     # ▼▼▼ 新規追加: 設定ファイルがない場合にデフォルトを作成するメソッド ▼▼▼
     #def ensure_item_config(self):
         #config_path = Path("../Config/item_config.json")
@@ -265,10 +275,18 @@ class SampleObject:
 
                     # ===== 地震シミュ =====
                     # 震源地を決める関数
-                    epicenter = DefineEpicenter.define_epicenter(
-                        self.epicenter_line, 
-                        self.get_stage
-                    )
+                    if self.rupture_mode:
+                        # 断層に沿って広がる破壊域（先頭が破壊の開始点）
+                        rupture_cells, rupture_distances = DefineEpicenter.define_rupture(
+                            self.epicenter_line,
+                            self.get_stage
+                        )
+                        epicenter = tuple(int(v) for v in rupture_cells[0])
+                    else:
+                        epicenter = DefineEpicenter.define_epicenter(
+                            self.epicenter_line, 
+                            self.get_stage
+                        )
 
                     # マグニチュードを決める関数
                     magnitude = DefineMagnitude.DefineMagnitude.define_magnitude(
@@ -280,17 +298,17 @@ class SampleObject:
                     )
                     weakness_map = weakness_map_creator.get_weakness_map()
 
-                    sim_EQ = EQSimulatorVariableRho(
-                        epicenter=epicenter, #震源​
-                        magnitude=magnitude, #地震の規模​
-                        grid_shape= (Param.tile_width, Param.tile_height), #マップのグリッド情報
-                        rho_map = weakness_map, #地盤の脆さ
-                        # rho_map=np.ones((grid_width, grid_height)), #地盤密度を持つ配列​
-                        mu=10.0, #弾性係数​（定数）
-                        dt=0.05 #定数(上げると地震の広がる規模が大きくなる)
-                    )
-                    shaking_map = sim_EQ.run(steps=200) #揺れの大きの最大値を持つ配列（step数を上げると地震の広がる規模が大きくなる）​
-                    pane = sim_EQ.update_panels(panel_manager=pane)
+                    # 揺れの大きの最大値を持つ配列（step数を上げると地震の広がる規模が大きくなる）​
+                    # 単位インパルス応答のライブラリから引く（ライブラリはステージ選択時にバックグラウンドで準備しておく）
+                    if self.rupture_mode:
+                        # 破壊域の各マスの時系列を破壊が届くステップだけずらして足し合わせる
+                        library = self.get_history_library(stage_num, weakness_map, mu=10.0, dt=0.05, steps=200)
+                        shaking_map = library.lookup_rupture(rupture_cells, rupture_distances, magnitude)
+                    else:
+                        library = self.get_impulse_library(stage_num, stage_data, mu=10.0, dt=0.05, steps=200)
+                        shaking_map = library.lookup(epicenter, magnitude)
+                    # シミュレーターは作らず、引いた揺れの最大値でパネルを直接更新する
+                    pane = EQSimulatorVariableRho.apply_to_panels(pane, shaking_map)
                     # pane_result = pane.get_all_panels() # パネル情報（建物の破壊・非破壊）を更新
 
                     # ===== 津波シミュ =====
@@ -300,17 +318,29 @@ class SampleObject:
                     )
                     permeability_map = permeability_map_creator.get_permeability_map()
 
-                    sim_tsunami = TsunamiSimulatorVariableRho(
-                        wave_source=epicenter, #震源​
-                        wave_height=magnitude*1.5, #地震の規模​ 1.5は要調整
-                        grid_shape= (Param.tile_width, Param.tile_height), #マップのグリッド情報
-                        spread_map = permeability_map, #地盤の脆さ
-                        # rho_map=np.ones((grid_width, grid_height)), #地盤密度を持つ配列​
-                        mu=10.0, #弾性係数​（定数）
-                        dt=0.05 #定数(上げると地震の広がる規模が大きくなる)
-                    )
-                    sim_tsunami.run(steps = 200)
-                    pane = sim_tsunami.update_panels(panel_manager=pane)
+                    # 震源が水域につながっていなければ津波は起きない（シミュレーションを省く）
+                    # max_distance を増やすと、その距離以内の一番近い水のマスから津波を発生させる
+                    connectivity = self.get_water_connectivity(stage_num, permeability_map)
+                    tsunami_source = connectivity.tsunami_source(epicenter, max_distance=0)
+                    if tsunami_source is None:
+                        max_wave = np.zeros((Param.tile_width, Param.tile_height))
+                        pane = TsunamiSimulatorVariableRho.apply_to_panels(pane, max_wave)
+                    else:
+                        # 津波は地震と別の時間刻み（dt）・グリッドの粗さ（coarsen）で計算できる
+                        # （今は地震と同じ dt=0.05 で 200 ステップ分。変える場合は 1.5 などの係数も調整する）
+                        # （thresholds= で倒壊判定による打ち切りもできるが、吸収層のないステージでは振幅の上限が下がらず打ち切れないので使わない）
+                        max_wave = TsunamiSimulatorVariableRho.run_multirate(
+                            duration=10.0, #物理時間（地震の 200 ステップ × dt=0.05 と同じ）
+                            dt=0.05, #津波の時間刻み（"auto" なら津波の波速の CFL 条件から決める）
+                            coarsen=1, #グリッドの縮小率
+                            wave_source=tsunami_source, #津波の発生地点（震源か一番近い水のマス）
+                            wave_height=magnitude*1.5, #地震の規模​ 1.5は要調整
+                            grid_shape= (Param.tile_width, Param.tile_height), #マップのグリッド情報
+                            spread_map = permeability_map, #地盤の脆さ
+                            masked=bool(np.any(permeability_map <= 0)), #陸（spread=0）のマスがあるステージだけ、水のマス（と遡上域）で波を伝え、陸は壁として扱う
+                            mu=10.0, #弾性係数​（定数）
+                        )
+                        pane = TsunamiSimulatorVariableRho.apply_to_panels(pane, max_wave)
                     # # 波の最大値（評価用）
                     # max_wave = sim_tsunami.run(steps=200)
                     # pane_result = pane.get_all_panels() # パネル情報（建物の破壊・非破壊）を更新    
@@ -773,6 +803,42 @@ class SampleObject:
             Param=Param
         )
         self.get_epicenter(self.stage)
+        # SPACE 押下時に待たないように、ステージを選んだ時点で揺れのライブラリの準備を始める
+        self.prepare_impulse_library(stage_num, self.stage.stage_data, mu=10.0, dt=0.05, steps=200)
+
+    def prepare_impulse_library(self, stage_num, stage_data, mu, dt, steps):
+        """
+            ステージの単位インパルス応答ライブラリの読み込み（ファイルがなければ作成）をバックグラウンドで始める。
+            地盤の脆さの計算もバックグラウンドで行うので、エラーは get_impulse_library() で受け取る。
+        """
+        if stage_num not in self.impulse_libraries:
+            self.impulse_libraries[stage_num] = self.library_builder.submit(
+                self.load_impulse_library, stage_num, stage_data, mu, dt, steps
+            )
+
+    @staticmethod
+    def load_impulse_library(stage_num, stage_data, mu, dt, steps):
+        """ステージの単位インパルス応答ライブラリを読み込む（ファイルがなければ作成）"""
+        weakness_map = DefineWeaknessMap(stage_data=stage_data).get_weakness_map()
+        path = Path("../Data/impulse") / f"map_sample{stage_num}_eq.npy"
+        return ImpulseResponseLibrary.load_or_build(path, rho_map=weakness_map, mu=mu, dt=dt, steps=steps)
+
+    def get_impulse_library(self, stage_num, stage_data, mu, dt, steps):
+        """ステージの単位インパルス応答ライブラリを取得（準備が終わっていなければ終わるまで待つ）"""
+        self.prepare_impulse_library(stage_num, stage_data, mu, dt, steps)
+        return self.impulse_libraries[stage_num].result()
+
+    def get_history_library(self, stage_num, weakness_map, mu, dt, steps):
+        """ステージの単位インパルス応答の時系列ライブラリを取得（使ったマスの分だけ計算し、ステージ毎に 256MB まで覚える）"""
+        if stage_num not in self.history_libraries:
+            self.history_libraries[stage_num] = ImpulseHistoryLibrary(weakness_map, mu=mu, dt=dt, steps=steps)
+        return self.history_libraries[stage_num]
+
+    def get_water_connectivity(self, stage_num, permeability_map):
+        """ステージの水域の連結成分を取得（初回のみ計算）"""
+        if stage_num not in self.water_connectivities:
+            self.water_connectivities[stage_num] = WaterConnectivity(permeability_map, min_size=10) # 10マス未満の池からは津波を起こさない
+        return self.water_connectivities[stage_num]
 
     def get_epicenter(self, stage):
         self.get_stage = DefineEpicenter.get_stage_data(stage.stage_data)